@@ -0,0 +1,127 @@
+# assets.py
+import io
+import os
+import struct
+from typing import Dict, Iterable, Optional
+from dotenv import load_dotenv
+from aiogram.types import BufferedInputFile
+
+try:
+    from PIL import Image  # необязательная зависимость: без неё картинки шлются как есть
+except ImportError:
+    Image = None
+
+load_dotenv()
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+class Asset:
+    """Картинка, уже прочитанная в память и готовая к отправке"""
+
+    __slots__ = ('name', 'filename', 'data', 'original_size', 'width', 'height', 'uploads', 'upload_seconds')
+
+    def __init__(self, name: str, filename: str, data: bytes, original_size: int, width: int, height: int):
+        self.name = name
+        self.filename = filename
+        self.data = data
+        self.original_size = original_size
+        self.width = width
+        self.height = height
+        self.uploads = 0
+        self.upload_seconds = 0.0
+
+
+class AssetRegistry:
+    """
+    Все картинки из PHOTOS, загруженные один раз при старте.
+    На горячем пути нет ни stat, ни чтения с диска — только bytes из памяти.
+    """
+
+    def __init__(self, photos_dir: str = 'photos'):
+        self.photos_dir = photos_dir
+        # Telegram всё равно ужимает фото до 1280px по большей стороне
+        self.max_side = int(os.getenv('PHOTO_MAX_SIDE', '1280'))
+        self.optimize = os.getenv('PHOTO_OPTIMIZE', '1') == '1'
+        self.jpeg_quality = int(os.getenv('PHOTO_JPEG_QUALITY', '88'))
+
+        self._assets: Dict[str, Asset] = {}
+
+    def preload(self, names: Iterable[str]):
+        """Читает, проверяет и (если есть Pillow) ужимает картинки; вызывать в отдельном потоке"""
+        for name in dict.fromkeys(names):
+            path = os.path.join(self.photos_dir, name)
+            try:
+                with open(path, 'rb') as f:
+                    raw = f.read()
+                asset = self._prepare(name, raw)
+            except Exception as e:
+                print(f"Картинка {path} пропущена: {e}")
+                continue
+            self._assets[name] = asset
+
+        total_before = sum(asset.original_size for asset in self._assets.values())
+        total_after = sum(len(asset.data) for asset in self._assets.values())
+        print(
+            f"DEBUG: загружено картинок: {len(self._assets)}, "
+            f"{total_before // 1024} КБ → {total_after // 1024} КБ"
+        )
+
+    def _prepare(self, name: str, raw: bytes) -> Asset:
+        if raw[:8] != PNG_SIGNATURE:
+            raise ValueError("не PNG")
+        width, height = struct.unpack('>II', raw[16:24])
+
+        if not (self.optimize and Image is not None):
+            return Asset(name, name, raw, len(raw), width, height)
+
+        image = Image.open(io.BytesIO(raw))
+        image.load()
+        if max(image.size) > self.max_side:
+            image.thumbnail((self.max_side, self.max_side))
+
+        # Прозрачность Telegram всё равно не покажет — кладём на белый фон и жмём в JPEG
+        if image.mode in ('RGBA', 'LA', 'P'):
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+
+        buffer = io.BytesIO()
+        image.save(buffer, format='JPEG', quality=self.jpeg_quality, optimize=True)
+        data = buffer.getvalue()
+
+        if len(data) >= len(raw):
+            return Asset(name, name, raw, len(raw), width, height)
+
+        filename = os.path.splitext(name)[0] + '.jpg'
+        return Asset(name, filename, data, len(raw), image.width, image.height)
+
+    def get(self, name: str) -> Optional[Asset]:
+        return self._assets.get(name)
+
+    def input_file(self, name: str) -> Optional[BufferedInputFile]:
+        asset = self._assets.get(name)
+        if asset is None:
+            return None
+        return BufferedInputFile(asset.data, filename=asset.filename)
+
+    def record_upload(self, name: str, seconds: float):
+        asset = self._assets.get(name)
+        if asset is not None:
+            asset.uploads += 1
+            asset.upload_seconds += seconds
+
+    def metrics(self) -> Dict[str, dict]:
+        """Размер и статистика загрузок по каждой картинке"""
+        return {
+            name: {
+                'original_size': asset.original_size,
+                'size': len(asset.data),
+                'width': asset.width,
+                'height': asset.height,
+                'uploads': asset.uploads,
+                'avg_upload_seconds': asset.upload_seconds / asset.uploads if asset.uploads else None,
+            }
+            for name, asset in self._assets.items()
+        }
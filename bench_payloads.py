@@ -0,0 +1,89 @@
+# bench_payloads.py
+"""
+Микробенчмарк разбора ответа NewsAPI: старый разбор (json в str и dict на каждую статью)
+против payloads.read_json + parse_newsapi. На один ответ печатает время CPU,
+пик памяти во время разбора и сколько памяти остаётся занято результатом.
+
+    python bench_payloads.py                       # синтетический ответ /v2/everything на 100 статей
+    python bench_payloads.py saved_response.json   # записанный ответ NewsAPI
+"""
+import json
+import sys
+import timeit
+import tracemalloc
+
+from payloads import loads, orjson, parse_newsapi
+
+LIMIT = 10
+ARTICLES = 100
+NUMBER = 2000
+
+
+def sample_payload(articles: int = ARTICLES) -> bytes:
+    """Тело ответа в формате NewsAPI /v2/everything — со всеми полями, которые бот не показывает"""
+    items = []
+    for i in range(articles):
+        items.append({
+            'source': {'id': None, 'name': f'Source {i % 7}'},
+            'author': f'Author {i}',
+            'title': f'Биткоин и рубль: обзор рынка №{i}',
+            'description': 'Краткое описание новости о курсах валют и криптовалют. ' * 3,
+            'url': f'https://news.example.com/articles/{i}',
+            'urlToImage': f'https://news.example.com/images/{i}.jpg',
+            'publishedAt': '2024-05-01T12:00:00Z',
+            'content': 'Полный текст статьи, обрезанный NewsAPI до двухсот символов… ' * 4 + '[+2400 chars]',
+        })
+    return json.dumps({'status': 'ok', 'totalResults': articles, 'articles': items}, ensure_ascii=False).encode('utf-8')
+
+
+def parse_old(body: bytes, limit: int = LIMIT) -> list:
+    """Разбор до payloads.py: resp.json() декодирует тело в str, на статью — свой dict"""
+    data = json.loads(body.decode('utf-8'))
+    articles = data.get('articles', [])
+    result = []
+    for a in articles[:limit]:
+        result.append({
+            'title': a.get('title', 'Без заголовка'),
+            'url': a.get('url', ''),
+            'source': a.get('source', {}).get('name', 'Unknown'),
+            'published_at': a.get('publishedAt', ''),
+        })
+    return result
+
+
+def parse_new(body: bytes, limit: int = LIMIT) -> list:
+    return parse_newsapi(loads(body), limit)
+
+
+def measure_memory(parse, body: bytes):
+    """(пик во время разбора, удержано результатом) в байтах"""
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        result = parse(body)
+        retained, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    return peak - before, retained - before
+
+
+def main(argv):
+    if len(argv) > 1:
+        with open(argv[1], 'rb') as f:
+            body = f.read()
+    else:
+        body = sample_payload()
+
+    assert [item['title'] for item in parse_old(body)] == [item['title'] for item in parse_new(body)]
+
+    print(f"Ответ: {len(body) / 1024:.1f} KB, limit={LIMIT}, парсер: {'orjson' if orjson else 'json'}")
+    for name, parse in (('старый разбор', parse_old), ('parse_newsapi', parse_new)):
+        seconds = min(timeit.repeat(lambda: parse(body), number=NUMBER, repeat=5)) / NUMBER
+        peak, retained = measure_memory(parse, body)
+        print(f"{name:>14}: {seconds * 1e6:8.1f} us, пик {peak / 1024:8.1f} KB, удержано {retained / 1024:5.1f} KB")
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,55 @@
+# http_client.py
+import aiohttp
+import os
+from typing import Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+class HttpClient:
+    """Общий пул HTTP-соединений для всех внешних API (ExchangeRate, CryptoCompare, NewsAPI...)"""
+
+    def __init__(self):
+        # Лимиты пула можно переопределить через .env
+        self.limit = int(os.getenv('HTTP_POOL_LIMIT', '100'))
+        self.limit_per_host = int(os.getenv('HTTP_POOL_LIMIT_PER_HOST', '20'))
+        self.dns_cache_ttl = int(os.getenv('HTTP_DNS_CACHE_TTL', '300'))
+        self.keepalive_timeout = float(os.getenv('HTTP_KEEPALIVE_TIMEOUT', '30'))
+        self.total_timeout = float(os.getenv('HTTP_TOTAL_TIMEOUT', '30'))
+
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def start(self):
+        """Создаёт сессию заранее (вызывается при старте бота)"""
+        self.get_session()
+        print(
+            f"DEBUG: HTTP пул запущен (limit={self.limit}, per_host={self.limit_per_host}, "
+            f"dns_ttl={self.dns_cache_ttl}s, keepalive={self.keepalive_timeout}s)"
+        )
+
+    def get_session(self) -> aiohttp.ClientSession:
+        """Возвращает общую сессию, создавая её при первом обращении"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                ttl_dns_cache=self.dns_cache_ttl,
+                use_dns_cache=True,
+                keepalive_timeout=self.keepalive_timeout,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.total_timeout),
+            )
+        return self._session
+
+    async def close(self):
+        """Закрывает сессию и все соединения пула (вызывается при остановке бота)"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+
+# Один клиент на весь процесс
+http_client = HttpClient()
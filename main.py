@@ -1,14 +1,17 @@
 import asyncio
+import multiprocessing
 import os
+import time
 from datetime import datetime
-from typing import Dict, Any, List
+from typing import Dict, Optional
 from dotenv import load_dotenv
 
 from aiogram import Bot, Dispatcher, types, F
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
 
 from data import CURRENCIES, CRYPTOCURRENCIES, ALL_CURRENCIES
 from keyboards import (
@@ -24,8 +27,21 @@ from keyboards import (
 )
 from services import CurrencyConverter
 from news_service import NewsService
+from http_client import http_client
+from rate_refresher import RateRefresher
+from market_board import MarketBoard
+from render_cache import RenderCache
+from media_cache import MediaCache
+from assets import AssetRegistry
+from user_store import UserStore, UserState
+from storage import create_storage
+from message_cleaner import MessageCleaner
+from send_scheduler import SendScheduler
+from webhook_server import WebhookServer, webhook_processes
+from update_limiter import UpdateLimiterMiddleware
 import os
 from aiogram.types import FSInputFile
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
 
 
 
@@ -68,23 +84,13 @@ PHOTOS = {
 
 
 
-# В начале файла, после user_data
-user_messages: Dict[int, List[int]] = {}
-
-def ensure_user_data(user_id: int) -> dict:
+async def ensure_user_data(user_id: int) -> UserState:
     """Создаёт запись пользователя, если её нет"""
-    if user_id not in user_data:
-        user_data[user_id] = {
-            'base_currency': 'RUB',  # или 'USD' — как тебе удобнее
-            'conversion_history': []
-        }
-    return user_data[user_id]
+    return await user_store.get(user_id)
 
 # Функция для сохранения ID сообщения
-def save_message_id(user_id: int, message_id: int):
-    if user_id not in user_messages:
-        user_messages[user_id] = []
-    user_messages[user_id].append(message_id)
+async def save_message_id(user_id: int, message_id: int):
+    await user_store.add_message_id(user_id, message_id)
 
 async def safe_edit_caption(callback_or_message, text: str, reply_markup=None):
     """Безопасное редактирование caption у фото — не падает никогда"""
@@ -107,9 +113,10 @@ async def safe_edit_caption(callback_or_message, text: str, reply_markup=None):
                 await msg.delete()
             except:
                 pass
-            await bot.send_photo(
+            await send_cached_photo(
+                bot.send_photo,
+                "Group 1.png",  # fallback фото
                 chat_id=msg.chat.id,
-                photo=FSInputFile("photos/Group 1.png"),  # fallback фото
                 caption=text,
                 reply_markup=reply_markup,
                 parse_mode="Markdown"
@@ -119,49 +126,76 @@ async def safe_edit_caption(callback_or_message, text: str, reply_markup=None):
 
 async def delete_last_bot_message(user_id: int):
     """Удаляет последнее сообщение бота у пользователя"""
-    if user_id in user_messages and user_messages[user_id]:
+    message_ids = (await user_store.get(user_id)).message_ids
+    if message_ids:
         try:
-            last_msg_id = user_messages[user_id][-1]
+            last_msg_id = message_ids[-1]
             await bot.delete_message(user_id, last_msg_id)
-            user_messages[user_id].pop()
+            await user_store.remove_message_ids(user_id, [last_msg_id])
         except:
             pass
 
 # Функция для удаления предыдущих сообщений
-async def delete_previous_messages(user_id: int, keep_last: int = 1):
-    """Удаляет все предыдущие сообщения пользователя, оставляя только keep_last последних"""
-    if user_id in user_messages and len(user_messages[user_id]) > keep_last:
-        messages_to_delete = user_messages[user_id][:-keep_last]
+async def delete_previous_messages(user_id: int, keep_last: int = 1, background: Optional[bool] = None):
+    """
+    Удаляет все предыдущие сообщения пользователя, оставляя только keep_last последних.
+    По умолчанию (MESSAGE_DELETE_BACKGROUND=1) удаление идёт в фоне, и новый экран не ждёт его
+    """
+    # Забираем id сразу: сообщения, отправленные дальше, в эту пачку уже не попадут
+    messages_to_delete = await user_store.take_message_ids(user_id, keep_last)
+    if not messages_to_delete:
+        return
 
-        # Удаляем сообщения
-        for msg_id in messages_to_delete:
-            try:
-                await bot.delete_message(user_id, msg_id)
-            except:
-                pass  # Игнорируем ошибки при удалении
+    if background is None:
+        background = message_cleaner.background
+    if background:
+        message_cleaner.delete_in_background(user_id, messages_to_delete)
+    else:
+        await message_cleaner.delete(user_id, messages_to_delete)
 
-        # Оставляем только последние сообщения
-        user_messages[user_id] = user_messages[user_id][-keep_last:]
+
+async def send_cached_photo(send, photo_name: str, **kwargs):
+    """
+    Отправляет фото через send (message.answer_photo / bot.send_photo):
+    по file_id из кэша, а если его нет или Telegram его отверг — загрузкой файла
+    """
+    file_id = media_cache.get(photo_name)
+    if file_id:
+        try:
+            return await send(photo=file_id, **kwargs)
+        except TelegramBadRequest as e:
+            if not media_cache.is_stale_error(e):
+                raise
+            print(f"file_id для {photo_name} устарел, загружаю файл заново")
+            media_cache.forget(photo_name)
+
+    photo = assets.input_file(photo_name) or FSInputFile(f"photos/{photo_name}")
+    started = time.monotonic()
+    sent_message = await send(photo=photo, **kwargs)
+    assets.record_upload(photo_name, time.monotonic() - started)
+    media_cache.remember(photo_name, sent_message)
+    return sent_message
 
 
 async def send_photo(message, photo_key, caption="", reply_markup=None, parse_mode=None, **kwargs):
     """Отправляет фотографию по ключу из словаря PHOTOS"""
     try:
-        photo_path = f"photos/{PHOTOS.get(photo_key, 'Group 1.png')}"
-        if os.path.exists(photo_path):
-            photo = FSInputFile(photo_path)
-            sent_message = await message.answer_photo(
-                photo=photo,
+        photo_name = PHOTOS.get(photo_key, 'Group 1.png')
+        # Файлы проверены и прочитаны при старте — здесь только поиск в памяти
+        if media_cache.get(photo_name) or assets.get(photo_name):
+            sent_message = await send_cached_photo(
+                message.answer_photo,
+                photo_name,
                 caption=caption,
                 reply_markup=reply_markup,
                 parse_mode=parse_mode,
                 **kwargs
             )
             # Сохраняем ID сообщения
-            save_message_id(message.from_user.id, sent_message.message_id)
+            await save_message_id(message.from_user.id, sent_message.message_id)
             return True, sent_message
         else:
-            print(f"Файл {photo_path} не найден")
+            print(f"Картинка {photo_name} не загружена")
             # Отправляем просто текст, если фото не найдено
             sent_message = await message.answer(
                 caption,
@@ -169,8 +203,12 @@ async def send_photo(message, photo_key, caption="", reply_markup=None, parse_mo
                 parse_mode=parse_mode,
                 **kwargs
             )
-            save_message_id(message.from_user.id, sent_message.message_id)
+            await save_message_id(message.from_user.id, sent_message.message_id)
             return False, sent_message
+    except TelegramRetryAfter as e:
+        # Повторы уже сделал планировщик; ещё одна отправка только усилит флуд
+        print(f"Фото {photo_key} не отправлено из-за лимитов Telegram: {e}")
+        return False, None
     except Exception as e:
         print(f"Ошибка при отправке фотографии {photo_key}: {e}")
         # Fallback на текстовое сообщение
@@ -180,7 +218,7 @@ async def send_photo(message, photo_key, caption="", reply_markup=None, parse_mo
             parse_mode=parse_mode,
             **kwargs
         )
-        save_message_id(message.from_user.id, sent_message.message_id)
+        await save_message_id(message.from_user.id, sent_message.message_id)
         return False, sent_message
 
 
@@ -188,11 +226,31 @@ async def send_photo(message, photo_key, caption="", reply_markup=None, parse_mo
 load_dotenv()
 
 # Инициализация бота
-bot = Bot(token=os.getenv('BOT_TOKEN'))
-storage = MemoryStorage()
-dp = Dispatcher(storage=storage)
+# TELEGRAM_API_SERVER — свой Bot API сервер (или локальный фейк для нагрузочных тестов)
+api_server = os.getenv('TELEGRAM_API_SERVER')
+session = AiohttpSession(api=TelegramAPIServer.from_base(api_server)) if api_server else None
+bot = Bot(token=os.getenv('BOT_TOKEN'), session=session)
+# Все запросы к Telegram идут через общий планировщик с лимитами и приоритетами
+# Лимиты Telegram общие на бота, поэтому каждый webhook-процесс берёт свою долю
+send_scheduler = SendScheduler(processes=webhook_processes())
+bot.session.middleware(send_scheduler)
+# FSM-хранилище (STORAGE_BACKEND) подключается в main() — уже внутри своего процесса,
+# чтобы соединение с базой не переходило через fork в webhook-процессы
+dp = Dispatcher()
+# Апдейты одного пользователя — по очереди, общий предел параллельных хендлеров, без дублей callback'ов
+update_limiter = UpdateLimiterMiddleware()
+dp.update.outer_middleware(update_limiter)
 converter = CurrencyConverter()
+rate_refresher = RateRefresher(converter)
+market_board = MarketBoard(converter)
 news_service = NewsService()
+# Готовые тексты тяжёлых экранов по (версия данных, параметры)
+render_cache = RenderCache()
+media_cache = MediaCache()
+assets = AssetRegistry()
+message_cleaner = MessageCleaner(bot)
+# Данные пользователей: ограниченный по памяти стор вместо глобальных словарей (создаётся в main())
+user_store: Optional[UserStore] = None
 
 
 # Состояния FSM
@@ -205,10 +263,6 @@ class ConverterStates(StatesGroup):
     enter_news_search = State()
 
 
-# Хранение пользовательских данных (временное решение)
-user_data: Dict[int, Dict[str, Any]] = {}
-
-
 # Команда /start
 # Команда /start
 @dp.message(Command("start"))
@@ -216,21 +270,10 @@ async def cmd_start(message: types.Message):
     user_id = message.from_user.id
 
     # Очищаем все предыдущие сообщения пользователя
-    if user_id in user_messages:
-        for msg_id in user_messages[user_id]:
-            try:
-                await bot.delete_message(user_id, msg_id)
-            except:
-                pass
-        user_messages[user_id] = []
+    await delete_previous_messages(user_id, keep_last=0)
 
     # Инициализация данных пользователя
-    user_data[user_id] = {
-        'base_currency': 'RUB',
-        'conversion_history': []
-    }
-
-    base_currency = ensure_user_data(user_id)['base_currency']
+    base_currency = (await user_store.reset(user_id)).base_currency
 
     welcome_text = (
         "💱 *Конвертер валют*\n\n"
@@ -275,7 +318,7 @@ async def convert_currency(message: types.Message, state: FSMContext):
 @dp.message(F.text == "📊 Курсы валют")
 async def show_rates(message: types.Message, state: FSMContext):
     user_id = message.from_user.id
-    base_currency = user_data.get(user_id, {}).get('base_currency', 'RUB')
+    base_currency = (await ensure_user_data(user_id)).base_currency
 
     await delete_previous_messages(user_id, keep_last=0)
 
@@ -285,65 +328,26 @@ async def show_rates(message: types.Message, state: FSMContext):
     except:
         pass
 
-    loading_msg = await message.answer("🔄 Загружаю актуальные курсы...")
+    # Со свежим снимком экран собирается мгновенно — сообщение о загрузке только лишний запрос
+    loading_msg = await message.answer("🔄 Загружаю актуальные курсы...") if converter.snapshot is None else None
 
     try:
-        # Получаем курсы ОТНОСИТЕЛЬНО базовой валюты
+        # Получаем курсы ОТНОСИТЕЛЬНО базовой валюты — один снимок на весь экран
         rates = await converter.get_all_rates(base_currency)
         if not rates:
-            await loading_msg.edit_text("❌ Не удалось получить курсы валют. Попробуйте позже.")
+            text = "❌ Не удалось получить курсы валют. Попробуйте позже."
+            await (loading_msg.edit_text(text) if loading_msg else message.answer(text))
             return
 
-        rates_text = f"📈 *Курсы к {base_currency}:*\n\n"
-
-        # Список валют для отображения (все популярные, кроме базовой)
-        currencies_to_show = [
-            ('🇷🇺', 'RUB'),
-            ('🇺🇸', 'USD'),
-            ('🇪🇺', 'EUR'),
-            ('🇬🇧', 'GBP'),
-            ('🇯🇵', 'JPY'),
-            ('🇨🇳', 'CNY'),
-            ('🇨🇭', 'CHF'),
-            ('🇨🇦', 'CAD'),
-            ('🇹🇷', 'TRY'),
-            ('🇰🇿', 'KZT'),
-            ('🇺🇦', 'UAH'),
-            ('🇧🇾', 'BYN'),
-            ('🇦🇪', 'AED')
-        ]
-
-        # Фильтруем - оставляем только те, которые не являются базовой валютой
-        currencies_to_show = [(emoji, code) for emoji, code in currencies_to_show if code != base_currency]
-
-        for emoji, target_currency in currencies_to_show[:10]:  # Показываем первые 10
-            # Получаем курс из base_currency в target_currency
-            rate_from_base_to_target = await converter.get_exchange_rate(base_currency, target_currency)
-
-            if rate_from_base_to_target:
-                # Вычисляем обратный курс: 1 target_currency = ? base_currency
-                reverse_rate = 1 / rate_from_base_to_target
-
-                # Форматируем в зависимости от величины
-                if reverse_rate < 0.01:
-                    formatted_rate = f"{reverse_rate:.6f}"
-                elif reverse_rate < 1:
-                    formatted_rate = f"{reverse_rate:.4f}"
-                elif reverse_rate < 10:
-                    formatted_rate = f"{reverse_rate:.3f}"
-                elif reverse_rate < 100:
-                    formatted_rate = f"{reverse_rate:.2f}"
-                elif reverse_rate < 1000:
-                    formatted_rate = f"{reverse_rate:.1f}"
-                else:
-                    formatted_rate = f"{reverse_rate:.0f}"
-
-                rates_text += f"{emoji} 1 {target_currency} = {formatted_rate} {base_currency}\n"
-
-        rates_text += f"\n📅 *Обновлено:* {datetime.now().strftime('%d.%m.%Y %H:%M')}"
+        stale = converter.snapshot is not None and converter.is_snapshot_stale()
+        rates_text = render_cache.get_or_render(
+            "rates", rates_version(base_currency), (base_currency, stale),
+            lambda: render_rates(base_currency, rates, stale)
+        )
 
         # Удаляем сообщение о загрузке
-        await loading_msg.delete()
+        if loading_msg:
+            await loading_msg.delete()
 
         # Отправляем фото С подписью (текстом курсов)
         await send_photo(
@@ -355,7 +359,78 @@ async def show_rates(message: types.Message, state: FSMContext):
 
     except Exception as e:
         print(f"Ошибка: {e}")
-        await loading_msg.edit_text("❌ Ошибка при загрузке курсов")
+        if loading_msg:
+            await loading_msg.edit_text("❌ Ошибка при загрузке курсов")
+        else:
+            await message.answer("❌ Ошибка при загрузке курсов")
+
+
+# Валюты экрана "Курсы валют" (базовая из списка исключается)
+RATES_SCREEN_CURRENCIES = [
+    ('🇷🇺', 'RUB'),
+    ('🇺🇸', 'USD'),
+    ('🇪🇺', 'EUR'),
+    ('🇬🇧', 'GBP'),
+    ('🇯🇵', 'JPY'),
+    ('🇨🇳', 'CNY'),
+    ('🇨🇭', 'CHF'),
+    ('🇨🇦', 'CAD'),
+    ('🇹🇷', 'TRY'),
+    ('🇰🇿', 'KZT'),
+    ('🇺🇦', 'UAH'),
+    ('🇧🇾', 'BYN'),
+    ('🇦🇪', 'AED')
+]
+
+
+def rates_version(base_currency: str):
+    """Версия данных для экранов курсов: версия снимка, если база в нём есть (иначе кэшировать нельзя)"""
+    matrix = converter.snapshot
+    if matrix is not None and base_currency in matrix:
+        return matrix.version
+    return None
+
+
+def rates_updated_at() -> str:
+    matrix = converter.snapshot
+    updated = datetime.fromtimestamp(matrix.fetched_at) if matrix is not None else datetime.now()
+    return updated.strftime('%d.%m.%Y %H:%M')
+
+
+def render_rates(base_currency: str, rates: Dict[str, float], stale: bool) -> str:
+    lines = [f"📈 *Курсы к {base_currency}:*\n"]
+
+    # Фильтруем - оставляем только те, которые не являются базовой валютой
+    currencies_to_show = [(emoji, code) for emoji, code in RATES_SCREEN_CURRENCIES if code != base_currency]
+
+    for emoji, target_currency in currencies_to_show[:10]:  # Показываем первые 10
+        # Курс из base_currency в target_currency берём из того же снимка, без запросов к API
+        rate_from_base_to_target = rates.get(target_currency)
+
+        if rate_from_base_to_target:
+            # Вычисляем обратный курс: 1 target_currency = ? base_currency
+            reverse_rate = 1 / rate_from_base_to_target
+
+            # Форматируем в зависимости от величины
+            if reverse_rate < 0.01:
+                formatted_rate = f"{reverse_rate:.6f}"
+            elif reverse_rate < 1:
+                formatted_rate = f"{reverse_rate:.4f}"
+            elif reverse_rate < 10:
+                formatted_rate = f"{reverse_rate:.3f}"
+            elif reverse_rate < 100:
+                formatted_rate = f"{reverse_rate:.2f}"
+            elif reverse_rate < 1000:
+                formatted_rate = f"{reverse_rate:.1f}"
+            else:
+                formatted_rate = f"{reverse_rate:.0f}"
+
+            lines.append(f"{emoji} 1 {target_currency} = {formatted_rate} {base_currency}")
+
+    lines.append(f"\n📅 *Обновлено:* {rates_updated_at()}")
+    if stale:
+        lines.append("⚠️ Курсы могут быть устаревшими — источник временно недоступен")
+    return "\n".join(lines)
 
 @dp.message(F.text == "⚙️ Выбрать основную валюту")
 async def set_base_currency(message: types.Message, state: FSMContext):
@@ -604,7 +679,13 @@ async def process_crypto_pair(callback: types.CallbackQuery):
         # Сначала отправляем текстовое сообщение о загрузке
         loading_msg = await callback.message.answer(f"🔄 Получаю курс {base}/{target}...")
 
-        rate = await converter.get_exchange_rate(base, target)
+        # Курс из снимка фонового обновления — без запроса к API; сеть только если пары в снимке нет
+        matrix = converter.snapshot
+        rate = matrix.rate(base, target) if matrix is not None else None
+        updated_at = matrix.fetched_at if rate else time.time()
+        if not rate:
+            quotes = await converter.get_crypto_quotes([base], [target])
+            rate = quotes.get(base, {}).get(target) or await converter.get_exchange_rate(base, target)
 
         if rate:
             base_name = CRYPTOCURRENCIES.get(base, base)
@@ -615,7 +696,7 @@ async def process_crypto_pair(callback: types.CallbackQuery):
                     f"{base_name} → {target_name}\n\n"
                     f"💰 1 {base} = *${rate:,.2f}*\n"
                     f"🔄 1 USD = {1 / rate:.8f} {base}\n\n"
-                    f"📅 *Обновлено:* " + datetime.now().strftime('%d.%m.%Y %H:%M')
+                    f"📅 *Обновлено:* " + datetime.fromtimestamp(updated_at).strftime('%d.%m.%Y %H:%M')
             )
 
             # Редактируем текстовое сообщение
@@ -639,46 +720,15 @@ async def process_crypto_pair(callback: types.CallbackQuery):
 
 @dp.callback_query(F.data == "crypto_top")
 async def show_top_crypto(callback: types.CallbackQuery):
-    loading_msg = await safe_edit_caption(callback, "🔄 Загружаю реальные данные с бирж...")
-
     try:
-        top_crypto = await converter.get_top_cryptocurrencies(10)
+        # Общая доска рынка: в API ходит фоновое обновление, а не каждый пользователь
+        board = await market_board.get()
+        top_crypto = board.top(10) if board else ()
 
         if top_crypto:
-            message_text = "🏆 *Топ-10 криптовалют (по рыночной капитализации)*\n\n"
-
-            for i, crypto in enumerate(top_crypto, 1):
-                symbol = crypto.get('symbol', '')
-                name = crypto.get('name', '')
-                price = crypto.get('price', 0)
-                change = crypto.get('change', 0)
-
-                # Определяем эмодзи для изменения цены
-                change_emoji = "📈" if change >= 0 else "📉"
-                change_color = "🟢" if change >= 0 else "🔴"
-
-                # Форматируем цену в зависимости от величины
-                if price < 0.0001:
-                    price_str = f"${price:.8f}"
-                elif price < 0.01:
-                    price_str = f"${price:.6f}"
-                elif price < 1:
-                    price_str = f"${price:.4f}"
-                elif price < 100:
-                    price_str = f"${price:.2f}"
-                elif price < 10000:
-                    price_str = f"${price:,.2f}"
-                else:
-                    price_str = f"${price:,.0f}"
-
-                message_text += (
-                    f"{i}. *{name} ({symbol})*\n"
-                    f"   💰 Цена: {price_str}\n"
-                    f"   {change_emoji} Изменение за 24ч: {change_color} {change:+.2f}%\n\n"
-                )
-
-            message_text += "📊 *Источник:* CoinGecko API\n"
-            message_text += "🔄 *Обновлено:* " + datetime.now().strftime('%d.%m.%Y %H:%M')
+            message_text, keyboard = render_cache.get_or_render(
+                "top_crypto", board.version, None, lambda: render_top_crypto(board, top_crypto)
+            )
 
             await callback.message.delete()
 
@@ -686,7 +736,7 @@ async def show_top_crypto(callback: types.CallbackQuery):
                 callback.message,
                 "top_crypto",
                 message_text,
-                reply_markup=get_top_crypto_keyboard(),
+                reply_markup=keyboard,
                 parse_mode="Markdown"
             )
 
@@ -694,28 +744,91 @@ async def show_top_crypto(callback: types.CallbackQuery):
                 await callback.message.answer(
                     message_text,
                     parse_mode="Markdown",
-                    reply_markup=get_top_crypto_keyboard()
+                    reply_markup=keyboard
                 )
         else:
-            await loading_msg.edit_text("❌ Не удалось загрузить данные с бирж")
+            await safe_edit_caption(callback, "❌ Не удалось загрузить данные с бирж", get_top_crypto_keyboard())
 
     except Exception as e:
         print(f"Ошибка получения топа крипты: {e}")
-        await loading_msg.edit_text(f"❌ Ошибка загрузки: {str(e)}")
+        await safe_edit_caption(callback, f"❌ Ошибка загрузки: {str(e)}", get_top_crypto_keyboard())
 
     await callback.answer()
 
 
+def render_top_crypto(board, top_crypto) -> tuple:
+    lines = ["🏆 *Топ-10 криптовалют (по рыночной капитализации)*\n"]
+
+    for i, crypto in enumerate(top_crypto, 1):
+        symbol = crypto.get('symbol', '')
+        name = crypto.get('name', '')
+        price = crypto.get('price', 0)
+        change = crypto.get('change', 0)
+
+        # Определяем эмодзи для изменения цены
+        change_emoji = "📈" if change >= 0 else "📉"
+        change_color = "🟢" if change >= 0 else "🔴"
+
+        lines.append(
+            f"{i}. *{name} ({symbol})*\n"
+            f"   💰 Цена: {format_usd_price(price)}\n"
+            f"   {change_emoji} Изменение за 24ч: {change_color} {change:+.2f}%\n"
+        )
+
+    lines.append(f"📊 *Источник:* {board.source or 'последние сохранённые данные'}")
+    lines.append("🔄 *Обновлено:* " + format_board_time(board))
+    return "\n".join(lines), get_top_crypto_keyboard()
+
+
+def format_usd_price(price: float) -> str:
+    """Форматирует цену в долларах в зависимости от величины"""
+    if price < 0.0001:
+        return f"${price:.8f}"
+    elif price < 0.01:
+        return f"${price:.6f}"
+    elif price < 1:
+        return f"${price:.4f}"
+    elif price < 100:
+        return f"${price:.2f}"
+    elif price < 10000:
+        return f"${price:,.2f}"
+    else:
+        return f"${price:,.0f}"
+
+
+def format_board_time(board) -> str:
+    if not board.fetched_at:
+        return "—"
+    return datetime.fromtimestamp(board.fetched_at).strftime('%d.%m.%Y %H:%M')
+
+
 # Хендлер для детальной информации о криптовалюте
 @dp.callback_query(F.data.startswith("crypto_detail:"))
 async def show_crypto_detail(callback: types.CallbackQuery):
     crypto_code = callback.data.split(":")[1]
-
-    loading_msg = await callback.message.edit_caption(f"🔄 Загружаю данные {crypto_code}...")
+    main_currencies = ['USD', 'EUR', 'RUB', 'GBP', 'JPY']
 
     try:
-        # Получаем курсы для криптовалюты
-        rates = await converter.get_all_rates(crypto_code)
+        board = await market_board.get()
+        coin = board.get(crypto_code) if board else None
+
+        if coin and coin.get('price'):
+            # Цена с доски (только реальные данные API или сохранённые с диска) в USD, остальные валюты — через локальный снимок курсов
+            rates = {'USD': coin['price']}
+            matrix = converter.snapshot
+            for currency in main_currencies[1:]:
+                if matrix is not None and currency in matrix:
+                    rates[currency] = coin['price'] * matrix.rate('USD', currency)
+            updated = format_board_time(board)
+        else:
+            # Монеты нет в топе или доска пуста (API топа недоступны) — одна пакетная котировка
+            await callback.message.edit_caption(caption=f"🔄 Загружаю данные {crypto_code}...")
+            quotes = await converter.get_crypto_quotes([crypto_code], main_currencies)
+            rates = quotes.get(crypto_code, {})
+            # Котировки обычно берутся из снимка курсов — тогда и время его
+            matrix = converter.snapshot
+            updated_at = matrix.fetched_at if matrix is not None and crypto_code in matrix else time.time()
+            updated = datetime.fromtimestamp(updated_at).strftime('%d.%m.%Y %H:%M')
 
         if rates:
             crypto_name = CRYPTOCURRENCIES.get(crypto_code, crypto_code)
@@ -723,26 +836,33 @@ async def show_crypto_detail(callback: types.CallbackQuery):
             message_text = f"📊 *{crypto_name}*\n\n"
             message_text += f"*Курсы:*\n"
 
-            # Показываем основные валюты
-            main_currencies = ['USD', 'EUR', 'RUB', 'GBP', 'JPY']
             for currency in main_currencies:
                 if currency in rates:
                     rate = rates[currency]
                     emoji = CURRENCIES.get(currency, '').split()[0] if currency in CURRENCIES else '💰'
                     message_text += f"{emoji} 1 {crypto_code} = {rate:.2f} {currency}\n"
 
-            message_text += f"\n🔄 *Обновлено:* " + datetime.now().strftime('%d.%m.%Y %H:%M')
+            if coin:
+                change = coin.get('change', 0)
+                message_text += f"\n{'📈' if change >= 0 else '📉'} *За 24ч:* {change:+.2f}%\n"
+                if coin.get('market_cap'):
+                    message_text += f"🏦 *Капитализация:* ${coin['market_cap']:,.0f}\n"
 
-            await loading_msg.edit_caption(
+            message_text += f"\n🔄 *Обновлено:* " + updated
+
+            await callback.message.edit_caption(
                 caption=message_text,
                 parse_mode="Markdown",
                 reply_markup=get_top_crypto_keyboard()  # чтобы кнопки остались
             )
         else:
-            await loading_msg.edit_text(f"❌ Не удалось получить данные для {crypto_code}")
+            await callback.message.edit_caption(
+                caption=f"❌ Не удалось получить данные для {crypto_code}",
+                reply_markup=get_top_crypto_keyboard()
+            )
 
     except Exception as e:
-        await loading_msg.edit_caption(
+        await callback.message.edit_caption(
             caption=f"Ошибка: {str(e)}",
             reply_markup=get_top_crypto_keyboard()
         )
@@ -1028,10 +1148,11 @@ async def cmd_convert(message: types.Message):
                 await message.answer(f"❌ Неизвестная валюта: {target_currency}")
                 return
 
-            # Конвертируем
-            result = await converter.convert(amount, base_currency, target_currency)
-            if result:
-                rate = await converter.get_exchange_rate(base_currency, target_currency)
+            # Конвертируем (курс приходит вместе с результатом)
+            conversion = await converter.convert(amount, base_currency, target_currency)
+            if conversion:
+                result = conversion.result
+                rate = conversion.rate
 
                 # Получаем названия
                 base_name = ALL_CURRENCIES.get(base_currency, base_currency)
@@ -1053,7 +1174,7 @@ async def cmd_convert(message: types.Message):
                     f"📤 {target_name}\n\n"
                     f"💰 {amount} {base_currency} = *{result_str} {target_currency}*\n\n"
                     f"📊 Курс: 1 {base_currency} = {rate:.8f} {target_currency}\n"
-                    f"🔄 Обратный: 1 {target_currency} = {1 / rate:.8f} {base_currency}"
+                    f"🔄 Обратный: 1 {target_currency} = {conversion.inverse:.8f} {base_currency}"
                 )
 
                 await message.answer(response_text, parse_mode="Markdown")
@@ -1091,9 +1212,12 @@ async def process_amount(message: types.Message, state: FSMContext):
         target_currency = data.get('target_currency')
 
         # Получаем курс и конвертируем
-        result = await converter.convert(amount, base_currency, target_currency)
+        conversion = await converter.convert(amount, base_currency, target_currency)
+
+        if conversion:
+            result = conversion.result
+            rate = conversion.rate
 
-        if result:
             # Форматируем вывод
             if result < 0.000001:
                 result_str = f"{result:.10f}"
@@ -1108,9 +1232,6 @@ async def process_amount(message: types.Message, state: FSMContext):
             else:
                 result_str = f"{result:,.2f}".replace(',', ' ')
 
-            # Получаем текущий курс
-            rate = await converter.get_exchange_rate(base_currency, target_currency)
-
             # Получаем названия валют
             base_name = ALL_CURRENCIES.get(base_currency, base_currency)
             target_name = ALL_CURRENCIES.get(target_currency, target_currency)
@@ -1121,27 +1242,17 @@ async def process_amount(message: types.Message, state: FSMContext):
                 f"📤 {target_name}\n\n"
                 f"💰 {amount} {base_currency} = *{result_str} {target_currency}*\n\n"
                 f"📈 Курс: 1 {base_currency} = {rate:.8f} {target_currency}\n"
-                f"🔄 Обратный: 1 {target_currency} = {1 / rate:.8f} {base_currency}"
+                f"🔄 Обратный: 1 {target_currency} = {conversion.inverse:.8f} {base_currency}"
             )
 
-            # Сохраняем в историю
-            user_id = message.from_user.id
-            if user_id not in user_data:
-                user_data[user_id] = {
-                    'base_currency': 'USD',
-                    'conversion_history': []
-                }
-
-            if 'conversion_history' not in user_data[user_id]:
-                user_data[user_id]['conversion_history'] = []
-
-            history_entry = {
-                'date': datetime.now().strftime('%d.%m.%Y %H:%M'),
-                'from': f"{amount} {base_currency}",
-                'to': f"{result_str} {target_currency}",
-                'rate': rate
-            }
-            user_data[user_id]['conversion_history'].append(history_entry)
+            # Сохраняем в историю (хранятся только последние USER_HISTORY_LIMIT записей)
+            await user_store.add_history(
+                message.from_user.id,
+                date=datetime.now().strftime('%d.%m.%Y %H:%M'),
+                from_=f"{amount} {base_currency}",
+                to=f"{result_str} {target_currency}",
+                rate=rate
+            )
 
             # Отправляем фотографию с результатом
             sent = await send_photo(
@@ -1168,24 +1279,22 @@ async def process_amount(message: types.Message, state: FSMContext):
 # Кнопка "Все валюты"
 @dp.message(F.text == "🌍 Все валюты")
 async def show_all_currencies(message: types.Message):
-    currencies_text = "🌍 *Все доступные валюты:*\n\n"
-
-    # Группируем по алфавиту
-    sorted_currencies = sorted(ALL_CURRENCIES.items())
-
-    for code, name in sorted_currencies:
-        currencies_text += f"{name}\n"
+    # Список валют не меняется, пока бот запущен — собираем текст один раз
+    currencies_text = render_cache.get_or_render("all_currencies", 0, None, render_all_currencies)
+    await message.answer(currencies_text, parse_mode="Markdown")
 
-    currencies_text += f"\nВсего: {len(ALL_CURRENCIES)} валют"
 
-    await message.answer(currencies_text, parse_mode="Markdown")
+def render_all_currencies() -> str:
+    # Группируем по алфавиту
+    names = "\n".join(name for code, name in sorted(ALL_CURRENCIES.items()))
+    return f"🌍 *Все доступные валюты:*\n\n{names}\n\nВсего: {len(ALL_CURRENCIES)} валют"
 
 
 # Кнопка "Топ курсов"
 @dp.message(F.text == "📈 Топ курсов")
 async def show_top_rates(message: types.Message):
     user_id = message.from_user.id
-    base_currency = user_data.get(user_id, {}).get('base_currency', 'USD')
+    base_currency = (await ensure_user_data(user_id)).base_currency
 
     loading_msg = await message.answer("📊 Загружаю топ курсов...")
 
@@ -1195,45 +1304,54 @@ async def show_top_rates(message: types.Message):
             await loading_msg.edit_text("❌ Ошибка загрузки")
             return
 
-        # Убираем базовую валюту из списка
-        rates_without_base = {code: rate for code, rate in rates.items() if
-                              code != base_currency and code in ALL_CURRENCIES}
+        top_text = render_cache.get_or_render(
+            "top_rates", rates_version(base_currency), base_currency,
+            lambda: render_top_rates(base_currency, rates)
+        )
+
+        await loading_msg.edit_text(top_text, parse_mode="Markdown")
 
-        # Получаем топ-5 самых дорогих валют относительно базовой
-        sorted_rates_desc = sorted(rates_without_base.items(), key=lambda x: x[1], reverse=True)
+    except Exception as e:
+        print(f"Ошибка в топ курсах: {e}")
+        await loading_msg.edit_text("❌ Ошибка при загрузке топ курсов")
 
-        top_text = f"🏆 *Топ-5 самых дорогих валют относительно {base_currency}:*\n\n"
 
-        for i, (code, rate) in enumerate(sorted_rates_desc[:5], 1):
-            currency_name = ALL_CURRENCIES.get(code, code)
-            top_text += f"{i}. {currency_name}\n"
-            top_text += f"   1 {base_currency} = {rate:.4f} {code}\n\n"
+def render_top_rates(base_currency: str, rates: Dict[str, float]) -> str:
+    # Убираем базовую валюту из списка
+    rates_without_base = {code: rate for code, rate in rates.items() if
+                          code != base_currency and code in ALL_CURRENCIES}
 
-        # Получаем топ-5 самых дешевых валют
-        sorted_rates_asc = sorted(rates_without_base.items(), key=lambda x: x[1])
+    # Получаем топ-5 самых дорогих валют относительно базовой
+    sorted_rates_desc = sorted(rates_without_base.items(), key=lambda x: x[1], reverse=True)
 
-        top_text += f"📉 *Топ-5 самых дешевых валют относительно {base_currency}:*\n\n"
+    lines = [f"🏆 *Топ-5 самых дорогих валют относительно {base_currency}:*\n"]
 
-        for i, (code, rate) in enumerate(sorted_rates_asc[:5], 1):
-            currency_name = ALL_CURRENCIES.get(code, code)
-            top_text += f"{i}. {currency_name}\n"
-            top_text += f"   1 {base_currency} = {rate:.6f} {code}\n\n"
+    for i, (code, rate) in enumerate(sorted_rates_desc[:5], 1):
+        currency_name = ALL_CURRENCIES.get(code, code)
+        lines.append(f"{i}. {currency_name}")
+        lines.append(f"   1 {base_currency} = {rate:.4f} {code}\n")
 
-        # Добавляем дополнительную информацию
-        if sorted_rates_desc and sorted_rates_asc:
-            most_expensive = sorted_rates_desc[0]
-            cheapest = sorted_rates_asc[0]
+    # Получаем топ-5 самых дешевых валют (тот же список в обратном порядке)
+    sorted_rates_asc = sorted_rates_desc[::-1]
 
-            top_text += f"💡 *Интересные факты:*\n"
-            top_text += f"• Самый высокий курс: 1 {base_currency} = {most_expensive[1]:.2f} {most_expensive[0]}\n"
-            top_text += f"• Самый низкий курс: 1 {base_currency} = {cheapest[1]:.6f} {cheapest[0]}\n"
-            top_text += f"• Разница: в {most_expensive[1] / cheapest[1]:.0f} раз"
+    lines.append(f"📉 *Топ-5 самых дешевых валют относительно {base_currency}:*\n")
 
-        await loading_msg.edit_text(top_text, parse_mode="Markdown")
+    for i, (code, rate) in enumerate(sorted_rates_asc[:5], 1):
+        currency_name = ALL_CURRENCIES.get(code, code)
+        lines.append(f"{i}. {currency_name}")
+        lines.append(f"   1 {base_currency} = {rate:.6f} {code}\n")
 
-    except Exception as e:
-        print(f"Ошибка в топ курсах: {e}")
-        await loading_msg.edit_text("❌ Ошибка при загрузке топ курсов")
+    # Добавляем дополнительную информацию
+    if sorted_rates_desc and sorted_rates_asc:
+        most_expensive = sorted_rates_desc[0]
+        cheapest = sorted_rates_asc[0]
+
+        lines.append(f"💡 *Интересные факты:*")
+        lines.append(f"• Самый высокий курс: 1 {base_currency} = {most_expensive[1]:.2f} {most_expensive[0]}")
+        lines.append(f"• Самый низкий курс: 1 {base_currency} = {cheapest[1]:.6f} {cheapest[0]}")
+        lines.append(f"• Разница: в {most_expensive[1] / cheapest[1]:.0f} раз")
+
+    return "\n".join(lines)
 
 
 # Обработка установки базовой валюты
@@ -1246,9 +1364,7 @@ async def process_set_base(callback: types.CallbackQuery, state: FSMContext):
     await delete_last_bot_message(user_id)
 
     # Сохраняем в данные пользователя
-    if user_id not in user_data:
-        user_data[user_id] = {}
-    ensure_user_data(user_id)['base_currency'] = currency
+    await user_store.set_base_currency(user_id, currency)
 
     text = (
         f"✅ Основная валюта изменена на: {currency}\n\n"
@@ -1316,7 +1432,7 @@ async def back_to_menu(callback: types.CallbackQuery):
     # base_currency = user_data[user_id]['base_currency']
 
     # Стало (никогда не упадёт):
-    base_currency = ensure_user_data(user_id)['base_currency']
+    base_currency = (await ensure_user_data(user_id)).base_currency
 
     welcome_text = (
         "💱 *Конвертер валют*\n\n"
@@ -1363,12 +1479,8 @@ async def process_news_search(message: types.Message, state: FSMContext):
     loading_msg = await message.answer(f"Ищу новости по запросу «{query}»...")
 
     try:
-        # ← ВОТ ТАК ДОЛЖНО БЫТЬ ТЕПЕРЬ:
-        news = await news_service._fetch_newsapi(query=query, limit=10, language='en')
-
-        # Если запрос на русском — ищем на русском
-        if any(c in query.lower() for c in ['рубль', 'россия', 'москва', 'цб', 'санкции', 'нефть']):
-            news = await news_service._fetch_newsapi(query=query, limit=10, language='ru')
+        # Язык определяется по самому запросу — один запрос к API, повторные поиски из кэша
+        news = await news_service.search_news(query, limit=10)
 
         message_text = news_service.format_news_message(news, f"Результаты по запросу «{query}»")
         await loading_msg.edit_text(message_text, parse_mode="Markdown", disable_web_page_preview=True)
@@ -1433,10 +1545,64 @@ async def show_finance_news(callback: types.CallbackQuery):
 
 
 
-async def main():
-    print("Бот запущен...")
-    await dp.start_polling(bot)
+async def main(primary: bool = True):
+    """
+    primary — основной процесс: регистрирует webhook и ведёт фоновые задачи (курсы, доска рынка,
+    сбор новостей, запись снимка на диск). Дополнительные webhook-процессы в API сами не ходят
+    и только подхватывают снимок, сохранённый основным.
+    """
+    global user_store
+    print("Бот запущен..." if primary else f"Webhook-процесс {os.getpid()} запущен...")
+    webhook_server = WebhookServer(dp, bot) if os.getenv('BOT_MODE', 'polling') == 'webhook' else None
+
+    # FSM и профили пользователей: память, SQLite или Redis (STORAGE_BACKEND)
+    storage, user_backing_store = create_storage()
+    dp.fsm.storage = storage
+    user_store = UserStore(user_backing_store)
+
+    await asyncio.to_thread(assets.preload, PHOTOS.values())
+    await http_client.start()
+    await converter.restore_snapshot()
+    await rate_refresher.start(follower=not primary)
+    await market_board.start(follower=not primary)
+    if primary:
+        await news_service.start_ingestion()
+    else:
+        await news_service.open_index()
+    try:
+        # BOT_MODE=webhook — приём апдейтов через aiohttp-сервер, иначе long polling
+        if webhook_server is not None:
+            await webhook_server.serve(set_webhook=primary)
+        else:
+            await dp.start_polling(bot)
+    finally:
+        await rate_refresher.stop()
+        await market_board.stop()
+        await news_service.stop_ingestion()
+        await message_cleaner.close()
+        # Дописываем отложенные изменения FSM и профилей до выхода
+        await storage.close()
+        await user_store.close()
+        await http_client.close()
+
+
+def run_webhook_worker():
+    """Дополнительный процесс webhook-сервера: слушает тот же порт, webhook не перерегистрирует"""
+    asyncio.run(main(primary=False))
 
 
 if __name__ == "__main__":
+    if os.getenv('BOT_MODE', 'polling') == 'webhook':
+        if not os.getenv('WEBHOOK_SECRET'):
+            raise SystemExit("WEBHOOK_SECRET обязателен в режиме webhook")
+
+        # Несколько процессов на одном порту (SO_REUSEPORT): FSM и профили должны быть общими.
+        # Лимиты Telegram делятся между процессами (SendScheduler), а очередь апдейтов одного
+        # пользователя (UpdateLimiterMiddleware) соблюдается только внутри процесса — его апдейты
+        # могут обрабатываться параллельно в разных процессах; профили это переживают (запись по полям)
+        processes = webhook_processes()
+        if processes > 1 and os.getenv('STORAGE_BACKEND', 'memory').lower() != 'redis':
+            raise SystemExit("WEBHOOK_PROCESSES > 1 требует STORAGE_BACKEND=redis")
+        for _ in range(processes - 1):
+            multiprocessing.Process(target=run_webhook_worker, daemon=True).start()
     asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,106 @@
+# market_board.py
+import asyncio
+import itertools
+import os
+import random
+from typing import Dict, Optional, Tuple
+from dotenv import load_dotenv
+
+load_dotenv()
+
+_versions = itertools.count(1)
+
+
+class Board:
+    """Неизменяемый снимок топа монет: один на всех пользователей до следующего обновления"""
+
+    __slots__ = ('coins', 'by_symbol', 'source', 'fetched_at', 'version')
+
+    def __init__(self, coins: Tuple[dict, ...], source: Optional[str], fetched_at: Optional[float]):
+        self.coins = coins
+        self.by_symbol: Dict[str, dict] = {coin['symbol']: coin for coin in coins}
+        self.source = source
+        self.fetched_at = fetched_at
+        self.version = next(_versions)
+
+    def top(self, limit: int) -> Tuple[dict, ...]:
+        return self.coins[:limit]
+
+    def get(self, symbol: str) -> Optional[dict]:
+        return self.by_symbol.get(symbol)
+
+
+class MarketBoard:
+    """
+    Общая доска рынка: топ-N монет (цена, капитализация, изменение за 24ч),
+    обновляется в фоне раз в MARKET_BOARD_INTERVAL. Экраны топа и карточки монеты
+    читают готовый снимок, так что нагрузка на API не зависит от числа пользователей.
+    """
+
+    def __init__(self, converter):
+        self.converter = converter
+        # С запасом относительно топ-10, чтобы карточки монет тоже брались отсюда
+        self.size = int(os.getenv('MARKET_BOARD_SIZE', '50'))
+        self.interval = float(os.getenv('MARKET_BOARD_INTERVAL', '120'))
+        self.jitter = float(os.getenv('RATE_REFRESH_JITTER', '0.1'))
+
+        self.board: Optional[Board] = None
+        self._refreshing: Optional[asyncio.Task] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self, follower: bool = False):
+        """follower — дополнительный процесс: публикует топ, который подхватил из снимка основного (см. RateRefresher)"""
+        # Топ, восстановленный с диска, показываем сразу — до первого ответа API
+        if self.board is None and self.converter.top_crypto:
+            self._publish(self.converter.top_crypto, None)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._follow() if follower else self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _publish(self, coins: list, source: Optional[str]) -> Board:
+        self.board = Board(tuple(coins), source, self.converter.top_crypto_fetched_at)
+        return self.board
+
+    async def refresh(self) -> Optional[Board]:
+        """Обновляет доску; одновременные вызовы ждут один и тот же запрос"""
+        if self._refreshing is None or self._refreshing.done():
+            self._refreshing = asyncio.create_task(self._refresh())
+        return await asyncio.shield(self._refreshing)
+
+    async def _refresh(self) -> Optional[Board]:
+        fetched_before = self.converter.top_crypto_fetched_at
+        coins = await self.converter.get_top_cryptocurrencies(self.size)
+        # get_top_cryptocurrencies сам откатывается на прошлый топ или мок-данные — на доску они не попадают:
+        # прошлый топ уже опубликован (в том числе восстановленный в start), а мок лучше пустого экрана только на вид
+        if not coins or self.converter.top_crypto_fetched_at == fetched_before:
+            return self.board
+        return self._publish(coins, self.converter.top_providers.last_provider)
+
+    async def get(self) -> Optional[Board]:
+        """Текущий снимок; при самом первом обращении — дожидается загрузки. None — реальных данных нет"""
+        if self.board is None:
+            await self.refresh()
+        return self.board
+
+    async def _run(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                print(f"Ошибка обновления доски рынка: {e}")
+            await asyncio.sleep(self.interval * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+    async def _follow(self):
+        while True:
+            await asyncio.sleep(self.interval * random.uniform(1 - self.jitter, 1 + self.jitter))
+            top_crypto = self.converter.top_crypto
+            if top_crypto and (self.board is None or self.board.fetched_at != self.converter.top_crypto_fetched_at):
+                self._publish(top_crypto, None)
@@ -0,0 +1,60 @@
+# media_cache.py
+import json
+import os
+from typing import Dict, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+class MediaCache:
+    """file_id картинок, уже загруженных в Telegram — повторно их можно слать без загрузки файла"""
+
+    # Так Telegram отвечает на file_id, который больше нельзя использовать
+    STALE_ERRORS = ('wrong file identifier', 'file_id', 'file reference', 'wrong remote file')
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.getenv('MEDIA_CACHE_PATH', 'media_cache.json')
+        self._file_ids: Dict[str, str] = {}
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self._file_ids = json.load(f)
+        except Exception as e:
+            print(f"Ошибка чтения {self.path}: {e}")
+            self._file_ids = {}
+
+    def _save(self):
+        # Свой временный файл у каждого процесса: webhook-процессы пишут кэш независимо
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._file_ids, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            print(f"Ошибка записи {self.path}: {e}")
+
+    def get(self, photo_name: str) -> Optional[str]:
+        return self._file_ids.get(photo_name)
+
+    def remember(self, photo_name: str, sent_message):
+        """Запоминает file_id самой большой версии фото из ответа Telegram"""
+        photos = getattr(sent_message, 'photo', None)
+        if not photos:
+            return
+        file_id = photos[-1].file_id
+        if self._file_ids.get(photo_name) != file_id:
+            self._file_ids[photo_name] = file_id
+            self._save()
+
+    def forget(self, photo_name: str):
+        if self._file_ids.pop(photo_name, None) is not None:
+            self._save()
+
+    def is_stale_error(self, error: Exception) -> bool:
+        text = str(error).lower()
+        return any(marker in text for marker in self.STALE_ERRORS)
@@ -0,0 +1,71 @@
+# message_cleaner.py
+import asyncio
+import os
+from typing import Iterable, List, Set
+from dotenv import load_dotenv
+
+from send_scheduler import PRIORITY_BACKGROUND, request_priority
+
+load_dotenv()
+
+# Ограничение Telegram на один вызов deleteMessages
+DELETE_MESSAGES_CHUNK = 100
+
+
+class MessageCleaner:
+    """
+    Удаление старых сообщений бота: пачками через deleteMessages (до 100 id за вызов),
+    при ошибке — поштучно с ограниченным параллелизмом. Может работать в фоне,
+    чтобы новый экран не ждал уборки старых.
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.concurrency = int(os.getenv('MESSAGE_DELETE_CONCURRENCY', '5'))
+        self.background = os.getenv('MESSAGE_DELETE_BACKGROUND', '1') == '1'
+
+        # Ссылки на фоновые задачи, чтобы их не собрал GC
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def delete(self, chat_id: int, message_ids: Iterable[int]):
+        """Удаляет сообщения; ошибки (уже удалено, старше 48 часов и т.п.) игнорируются"""
+        message_ids = list(message_ids)
+        chunks = [
+            message_ids[i:i + DELETE_MESSAGES_CHUNK]
+            for i in range(0, len(message_ids), DELETE_MESSAGES_CHUNK)
+        ]
+        await asyncio.gather(*(self._delete_chunk(chat_id, chunk) for chunk in chunks))
+
+    async def _delete_chunk(self, chat_id: int, chunk: List[int]):
+        if len(chunk) > 1:
+            try:
+                await self.bot.delete_messages(chat_id, chunk)
+                return
+            except Exception as e:
+                print(f"deleteMessages не сработал ({e}), удаляю по одному")
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def delete_one(message_id: int):
+            async with semaphore:
+                try:
+                    await self.bot.delete_message(chat_id, message_id)
+                except Exception:
+                    pass
+
+        await asyncio.gather(*(delete_one(message_id) for message_id in chunk))
+
+    def delete_in_background(self, chat_id: int, message_ids: Iterable[int]):
+        task = asyncio.create_task(self._delete_background(chat_id, message_ids))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _delete_background(self, chat_id: int, message_ids: Iterable[int]):
+        # У задачи своя копия контекста: низкий приоритет не протечёт в хендлер, который её запустил
+        request_priority.set(PRIORITY_BACKGROUND)
+        await self.delete(chat_id, message_ids)
+
+    async def close(self):
+        """Дожидается фоновых удалений (при остановке бота)"""
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
@@ -0,0 +1,157 @@
+# news_index.py
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Iterable, List, Optional
+from urllib.parse import urlsplit, urlunsplit
+from dotenv import load_dotenv
+
+from payloads import NewsItem
+
+load_dotenv()
+
+WORD_RE = re.compile(r'\w+')
+FTS_OPERATORS = ('OR', 'AND', 'NOT')
+# Окончания, которые отрезаются перед поиском по префиксу: "рубль" найдёт и "рубля", "rates" — "rate"
+STEM_ENDINGS = re.compile(r'(?<=\w{4})(?:[аеиоуыэюяьй]{1,2}|e?s)$')
+
+
+def normalize_url(url: str) -> str:
+    """Один и тот же материал часто приходит с разными хвостами: #якорь, '/' в конце, регистр хоста"""
+    parts = urlsplit(url.strip())
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path.rstrip('/'), parts.query, ''))
+
+
+def normalize_title(title: str) -> str:
+    """Заголовок без регистра, пунктуации и источника в конце ('... - Reuters')"""
+    title = title.rsplit(' - ', 1)[0] if ' - ' in title else title
+    return ' '.join(WORD_RE.findall(title.casefold().replace('ё', 'е')))
+
+
+def to_match_query(query: str) -> Optional[str]:
+    """
+    Запрос пользователя (или в стиле NewsAPI) → выражение FTS5 MATCH.
+    Слова ищутся по префиксу (без окончания), OR/AND/NOT сохраняются как операторы, -слово — это NOT слово.
+    В FTS5 NOT только бинарный ("a NOT b"), поэтому исключение без слова перед ним ("NOT рубль",
+    "курс OR -спорт") выразить нельзя — тогда None, и запрос уходит в API
+    """
+    terms = []
+    for token in query.replace('"', ' ').split():
+        negated = token == 'NOT' or (token.startswith('-') and len(token) > 1)
+        if negated and (not terms or terms[-1] in FTS_OPERATORS):
+            return None
+        if token in FTS_OPERATORS:
+            if terms and terms[-1] not in FTS_OPERATORS:
+                terms.append(token)
+            continue
+        if negated:
+            terms.append('NOT')
+            token = token[1:]
+        words = WORD_RE.findall(token.casefold().replace('ё', 'е'))
+        terms.extend(f'"{STEM_ENDINGS.sub("", word)}"*' for word in words)
+    while terms and terms[-1] in FTS_OPERATORS:
+        terms.pop()
+    return ' '.join(terms) or None
+
+
+class NewsIndex:
+    """
+    Локальный полнотекстовый индекс заголовков (SQLite FTS5).
+    Статьи дедуплицируются по URL и по нормализованному заголовку,
+    хранятся NEWS_INDEX_RETENTION_DAYS дней. Методы синхронные — вызывать через asyncio.to_thread.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.getenv('NEWS_INDEX_PATH', 'news_index.sqlite3')
+        self.retention = float(os.getenv('NEWS_INDEX_RETENTION_DAYS', '7')) * 86400
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS articles ("
+            "id INTEGER PRIMARY KEY, url TEXT UNIQUE, title_key TEXT UNIQUE, title TEXT, source TEXT, "
+            "published_at TEXT, currencies TEXT, language TEXT, ingested_at REAL);"
+            "CREATE VIRTUAL TABLE IF NOT EXISTS articles_fts USING fts5("
+            "title, tokenize='unicode61 remove_diacritics 2');"
+            "CREATE INDEX IF NOT EXISTS articles_ingested_at ON articles (ingested_at);"
+        )
+
+    def add(self, articles: Iterable[dict], language: str) -> int:
+        """Добавляет новые статьи; дубликаты (по URL или заголовку) пропускаются. Возвращает число новых"""
+        now = time.time()
+        added = 0
+        with self._lock, self._conn:
+            for article in articles:
+                title = article.get('title') or ''
+                url = article.get('url') or ''
+                title_key = normalize_title(title)
+                if not title_key or not url:
+                    continue
+                cursor = self._conn.execute(
+                    "INSERT OR IGNORE INTO articles "
+                    "(url, title_key, title, source, published_at, currencies, language, ingested_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (normalize_url(url), title_key, title, article.get('source', ''),
+                     article.get('published_at', ''), json.dumps(list(article.get('currencies') or ())),
+                     language, now)
+                )
+                if cursor.rowcount:
+                    self._conn.execute(
+                        "INSERT INTO articles_fts (rowid, title) VALUES (?, ?)",
+                        (cursor.lastrowid, title.replace('ё', 'е').replace('Ё', 'Е'))
+                    )
+                    added += 1
+        return added
+
+    def search(self, query: str, language: Optional[str] = None, limit: int = 10) -> List[NewsItem]:
+        """Самые релевантные и свежие статьи по запросу (пустой список, если ничего не нашлось)"""
+        match = to_match_query(query)
+        if match is None:
+            return []
+
+        sql = (
+            "SELECT a.title, a.url, a.source, a.published_at, a.currencies "
+            "FROM articles_fts JOIN articles a ON a.id = articles_fts.rowid "
+            "WHERE articles_fts MATCH ?"
+        )
+        params: list = [match]
+        if language:
+            sql += " AND a.language = ?"
+            params.append(language)
+        sql += " ORDER BY bm25(articles_fts), a.published_at DESC LIMIT ?"
+        params.append(limit)
+
+        try:
+            with self._lock:
+                rows = self._conn.execute(sql, params).fetchall()
+        except sqlite3.OperationalError as e:
+            # Синтаксис MATCH мог не понравиться FTS5 — это просто промах индекса
+            print(f"Ошибка поиска по индексу новостей: {e}")
+            return []
+
+        return [
+            NewsItem(title, url, source, published_at, tuple(json.loads(currencies)))
+            for title, url, source, published_at, currencies in rows
+        ]
+
+    def purge(self) -> int:
+        """Удаляет статьи старше окна хранения"""
+        cutoff = time.time() - self.retention
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM articles_fts WHERE rowid IN (SELECT id FROM articles WHERE ingested_at < ?)",
+                (cutoff,)
+            )
+            return self._conn.execute("DELETE FROM articles WHERE ingested_at < ?", (cutoff,)).rowcount
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM articles").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -1,135 +1,312 @@
 # news_service.py
-import aiohttp
+import asyncio
 import os
+import random
+import re
+import time
+from collections import OrderedDict
 from datetime import datetime
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
 from urllib.parse import urlparse
 from dotenv import load_dotenv
 
+from http_client import http_client
+from news_index import NewsIndex
+from payloads import parse_cryptopanic, parse_newsapi, read_json
+
 load_dotenv()
 
+CYRILLIC_RE = re.compile('[а-яё]', re.IGNORECASE)
+
+
+class Feed(list):
+    """Лента новостей из кэша: обычный список плюс время загрузки (устаревшая лента отдаётся со своим)"""
+
+    __slots__ = ('fetched_at',)
+
+    def __init__(self, items=(), fetched_at: Optional[float] = None):
+        super().__init__(items)
+        self.fetched_at = fetched_at if fetched_at is not None else time.time()
+
+# Язык лент для индекса поиска (категории, которых здесь нет, — англоязычные)
+FEED_LANGUAGES = {'russian_top': 'ru', 'russian_financial': 'ru'}
+
+
+class NewsCache:
+    """
+    Кэш лент новостей по категориям со stale-while-revalidate:
+    свежая лента отдаётся как есть, устаревшая — тоже сразу, но в фоне запускается
+    одно обновление; ждать API приходится только при самом первом запросе категории.
+    """
+
+    def __init__(self, max_entries: Optional[int] = None,
+                 on_update: Optional[Callable[[Hashable, list], Awaitable[None]]] = None):
+        # Протухшая лента всё ещё лучше 15-секундного ожидания, но не старше суток
+        self.max_stale = float(os.getenv('NEWS_CACHE_MAX_STALE', '86400'))
+        # Для поисковых запросов ключей сколько угодно — там нужен предел (LRU)
+        self.max_entries = max_entries
+        # Вызывается с каждой свежезагруженной лентой (например, чтобы положить её в индекс поиска)
+        self.on_update = on_update
+
+        self._entries: "OrderedDict[Hashable, Tuple[float, list]]" = OrderedDict()
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+
+    async def get_or_fetch(self, key: Hashable, ttl: float, fetcher: Callable[[], Awaitable[list]]) -> list:
+        entry = self._entries.get(key)
+        now = time.monotonic()
+
+        if entry is not None:
+            self._entries.move_to_end(key)
+            age = now - entry[0]
+            if age < ttl:
+                self.hits += 1
+                return entry[1]
+            if age < self.max_stale:
+                self.stale_hits += 1
+                self._refresh(key, fetcher)
+                return entry[1]
+
+        self.misses += 1
+        return await asyncio.shield(self._refresh(key, fetcher))
+
+    def _refresh(self, key: Hashable, fetcher: Callable[[], Awaitable[list]]) -> asyncio.Task:
+        """Одно обновление на ключ, сколько бы запросов ни пришло"""
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._fetch(key, fetcher))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return task
+
+    async def _fetch(self, key: Hashable, fetcher: Callable[[], Awaitable[list]]) -> list:
+        try:
+            items = await fetcher()
+        except Exception as e:
+            print(f"Ошибка обновления новостей {key}: {e}")
+            items = []
+
+        if items:
+            items = Feed(items)
+            self._entries[key] = (time.monotonic(), items)
+            self._entries.move_to_end(key)
+            if self.max_entries is not None:
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            if self.on_update is not None:
+                try:
+                    await self.on_update(key, items)
+                except Exception as e:
+                    print(f"Ошибка обработки ленты новостей {key}: {e}")
+            return items
+        # Пустой ответ (лимит API, таймаут) не затирает прошлую ленту
+        entry = self._entries.get(key)
+        return entry[1] if entry is not None else items
+
+    def invalidate(self, key: Optional[Hashable] = None):
+        if key is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(key, None)
+
 
 class NewsService:
     def __init__(self):
         self.newsapi_key = os.getenv('NEWS_API_KEY')
         self.cryptopanic_key = os.getenv('CRYPTO_PANIC_KEY')
 
+        # Бесплатный NewsAPI — NEWS_API_DAILY_BUDGET (100) запросов в сутки. Устаревшая лента отдаётся сразу,
+        # но обновляется в фоне, так что каждая открытая лента стоит запрос раз в TTL. Поэтому TTL по умолчанию
+        # считается из бюджета: лентам отдаётся NEWS_FEED_BUDGET_SHARE от него, остальное — поиску.
+        # Фоновый сбор ходит через тот же кэш и сверх этого ничего не тратит
+        daily_budget = float(os.getenv('NEWS_API_DAILY_BUDGET', '100'))
+        feed_share = float(os.getenv('NEWS_FEED_BUDGET_SHARE', '0.7'))
+        newsapi_feeds = len(self._ingest_sources()) - (1 if self.cryptopanic_key else 0)
+        budget_ttl = 86400 * newsapi_feeds / (daily_budget * feed_share)
+        self.news_ttl = float(os.getenv('NEWS_CACHE_TTL', budget_ttl))
+        # Криптоленту с ключом CryptoPanic отдаёт он (NewsAPI — только запасной), иначе она тоже из бюджета NewsAPI
+        self.crypto_news_ttl = float(os.getenv('NEWS_CACHE_CRYPTO_TTL', 600 if self.cryptopanic_key else self.news_ttl))
+        self.search_ttl = float(os.getenv('NEWS_SEARCH_TTL', '900'))
+        self.cache = NewsCache(on_update=self._index_feed)
+        self.search_cache = NewsCache(max_entries=int(os.getenv('NEWS_SEARCH_CACHE_SIZE', '500')))
+
+        # Фоновый сбор всех категорий в локальный полнотекстовый индекс для поиска.
+        # Проход обновляет только устаревшие ленты, так что раз в TTL он укладывается в бюджет лент
+        self.ingest_interval = float(os.getenv('NEWS_INGEST_INTERVAL', self.news_ttl))
+        self.index: Optional[NewsIndex] = None
+        self._ingest_task: Optional[asyncio.Task] = None
+
     async def _fetch_newsapi(self, query="", limit=10, country=None, language='en'):
         """Универсальная обёртка над NewsAPI — работает даже на бесплатном тарифе"""
         if not self.newsapi_key:
             return []
 
         try:
-            async with aiohttp.ClientSession() as session:
-                if not query and country:
-                    url = "https://newsapi.org/v2/top-headlines"
-                    params = {
-                        'apiKey': self.newsapi_key,
-                        'category': 'business',
-                        'country': country,
-                        'pageSize': limit,
-                        'language': language
-                    }
-                else:
-                    url = "https://newsapi.org/v2/everything"
-                    params = {
-                        'apiKey': self.newsapi_key,
-                        'q': query,
-                        'language': language,
-                        'sortBy': 'publishedAt',
-                        'pageSize': limit
-                    }
-
-                async with session.get(url, params=params, timeout=15) as resp:
-                    if resp.status != 200:
-                        return []
-                    data = await resp.json()
-                    articles = data.get('articles', [])
-                    result = []
-                    for a in articles[:limit]:
-                        result.append({
-                            'title': a.get('title', 'Без заголовка'),
-                            'url': a.get('url', ''),
-                            'source': a.get('source', {}).get('name', 'Unknown'),
-                            'published_at': a.get('publishedAt', ''),
-                        })
-                    return result
+            if not query and country:
+                url = "https://newsapi.org/v2/top-headlines"
+                params = {
+                    'apiKey': self.newsapi_key,
+                    'category': 'business',
+                    'country': country,
+                    'pageSize': limit,
+                    'language': language
+                }
+            else:
+                url = "https://newsapi.org/v2/everything"
+                params = {
+                    'apiKey': self.newsapi_key,
+                    'q': query,
+                    'language': language,
+                    'sortBy': 'publishedAt',
+                    'pageSize': limit
+                }
+
+            session = http_client.get_session()
+            async with session.get(url, params=params, timeout=15) as resp:
+                if resp.status != 200:
+                    return []
+                # Из статьи берём только нужные поля — сразу в компактные записи NewsItem
+                return parse_newsapi(await read_json(resp), limit)
         except Exception as e:
             print(f"NewsAPI ошибка: {e}")
             return []
 
     async def get_crypto_news(self, limit: int = 10):
         """Криптоновости с нормальными источниками"""
+        return await self.cache.get_or_fetch(
+            ('crypto', limit), self.crypto_news_ttl, lambda: self._fetch_crypto_news(limit)
+        )
+
+    async def _fetch_crypto_news(self, limit: int) -> List[dict]:
+        crypto_query = "bitcoin OR ethereum OR crypto OR blockchain"
         if not self.cryptopanic_key:
-            return await self._fetch_newsapi("bitcoin OR ethereum OR crypto OR blockchain", limit)
+            return await self._fetch_newsapi(crypto_query, limit)
+
+        # CryptoPanic и NewsAPI запрашиваются параллельно — берём первый нормальный ответ
+        return await self.first_acceptable([
+            lambda: self._fetch_cryptopanic(limit),
+            lambda: self._fetch_newsapi(crypto_query, limit),
+        ])
 
+    async def _fetch_cryptopanic(self, limit: int) -> List[dict]:
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(
-                    "https://cryptopanic.com/api/v1/posts/",
-                    params={'auth_token': self.cryptopanic_key, 'public': 'true', 'filter': 'hot'},
-                    timeout=20
-                ) as resp:
-                    if resp.status != 200:
-                        return await self._fetch_newsapi("bitcoin OR ethereum OR crypto", limit)
-
-                    data = await resp.json()
-                    results = data.get('results', [])
-                    out = []
-                    for item in results[:limit]:
-                        raw_url = item.get('url', '')
-                        domain = urlparse(raw_url).netloc.replace('www.', '') if raw_url else 'CryptoPanic'
-                        source = item.get('source', {}).get('title') or domain
-                        out.append({
-                            'title': item.get('title', ''),
-                            'url': raw_url,
-                            'source': source,
-                            'published_at': item.get('published_at', ''),
-                            'currencies': [c['code'] for c in item.get('currencies', [])][:3],
-                        })
-                    return out
+            session = http_client.get_session()
+            async with session.get(
+                "https://cryptopanic.com/api/v1/posts/",
+                params={'auth_token': self.cryptopanic_key, 'public': 'true', 'filter': 'hot'},
+                timeout=20
+            ) as resp:
+                if resp.status != 200:
+                    return []
+
+                return parse_cryptopanic(
+                    await read_json(resp), limit,
+                    lambda url: urlparse(url).netloc.replace('www.', '')
+                )
         except Exception as e:
             print(f"CryptoPanic ошибка: {e}")
-            return await self._fetch_newsapi("bitcoin OR ethereum OR crypto", limit)
+            return []
+
+    async def first_acceptable(
+        self,
+        strategies: List[Callable[[], Awaitable[list]]],
+        accept: Callable[[list], bool] = lambda news: len(news) >= 2,
+    ) -> list:
+        """
+        Цепочка запасных вариантов, но без последовательных таймаутов: следующая стратегия
+        стартует, если предыдущие не ответили за NEWS_FALLBACK_STAGGER секунд (или уже провалились),
+        побеждает первый ответ, прошедший accept, остальные отменяются. Если не прошёл никто —
+        берётся первый непустой ответ в порядке приоритета стратегий.
+        """
+        # Около обычного времени ответа первой стратегии: в нормальном случае запрос ровно один,
+        # а запасные тратят квоту API только когда первая зависла. 0 — запускать все сразу
+        stagger = float(os.getenv('NEWS_FALLBACK_STAGGER', '2'))
+        tasks: List[asyncio.Task] = []
+        results: Dict[int, list] = {}
+        pending = set()
+
+        try:
+            while len(results) < len(strategies):
+                # Следующая стратегия стартует по расписанию или сразу, если все запущенные уже провалились
+                if len(tasks) < len(strategies) and (stagger <= 0 or not pending):
+                    task = asyncio.create_task(strategies[len(tasks)]())
+                    tasks.append(task)
+                    pending.add(task)
+                    if stagger <= 0:
+                        continue
+
+                timeout = stagger if stagger > 0 and len(tasks) < len(strategies) else None
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done and len(tasks) < len(strategies):
+                    # Никто не ответил за stagger — подключаем следующую стратегию
+                    task = asyncio.create_task(strategies[len(tasks)]())
+                    tasks.append(task)
+                    pending.add(task)
+                    continue
+
+                for task in done:
+                    try:
+                        news = task.result() or []
+                    except Exception as e:
+                        print(f"Ошибка источника новостей: {e}")
+                        news = []
+                    results[tasks.index(task)] = news
+                    if accept(news):
+                        return news
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+        for index in range(len(strategies)):
+            if results.get(index):
+                return results[index]
+        return []
 
     async def get_latest_financial_news(self, limit: int = 10):
         q = 'business OR finance OR stock OR market OR economy OR "wall street" OR fed OR "interest rates"'
-        return await self._fetch_newsapi(q, limit)
+        return await self._cached_newsapi('latest', q, limit)
 
     async def get_us_financial_news(self, limit: int = 10):
         q = '(business OR finance OR economy OR market OR fed OR "interest rates") AND (us OR "united states" OR usa)'
-        return await self._fetch_newsapi(q, limit)
+        return await self._cached_newsapi('us', q, limit)
 
     async def get_economic_news(self, limit: int = 10):
         q = 'economy OR GDP OR inflation OR "interest rates" OR unemployment -sports -football'
-        return await self._fetch_newsapi(q, limit)
+        return await self._cached_newsapi('economy', q, limit)
 
     async def get_banking_news(self, limit: int = 10):
         q = '"central bank" OR "federal reserve" OR ECB OR "monetary policy" OR banks -sports -river'
-        return await self._fetch_newsapi(q, limit)
+        return await self._cached_newsapi('banking', q, limit)
+
+    async def _cached_newsapi(self, category: str, query: str, limit: int, language: str = 'en') -> List[dict]:
+        return await self.cache.get_or_fetch(
+            (category, limit), self.news_ttl,
+            lambda: self._fetch_newsapi(query, limit, language=language)
+        )
 
     async def get_russian_top_news(self, limit: int = 10):
         """РФ Все новости — всегда с новостями, даже если top-headlines пустой"""
-        # 1. Пробуем top-headlines (самые горячие)
-        news = await self._fetch_newsapi(country='ru', limit=limit, language='ru')
-        if news and len(news) >= 2:
-            return news
-
-        # 2. Если топ пустой — берём просто самые свежие русскоязычные новости за последние 48 часов
-        news = await self._fetch_newsapi(
-            query="",
-            limit=limit,
-            language='ru'
-        )
-        if news:
-            return news
-
-        # 3. Крайний fallback — ищем по общим словам, которые всегда есть
-        return await self._fetch_newsapi(
-            query="россия OR москва OR путин OR россияне OR рубль OR новости",
-            limit=limit,
-            language='ru'
+        return await self.cache.get_or_fetch(
+            ('russian_top', limit), self.news_ttl, lambda: self._fetch_russian_top_news(limit)
         )
 
+    async def _fetch_russian_top_news(self, limit: int) -> List[dict]:
+        return await self.first_acceptable([
+            # 1. top-headlines (самые горячие)
+            lambda: self._fetch_newsapi(country='ru', limit=limit, language='ru'),
+            # 2. Просто самые свежие русскоязычные новости
+            lambda: self._fetch_newsapi(query="", limit=limit, language='ru'),
+            # 3. Крайний fallback — ищем по общим словам, которые всегда есть
+            lambda: self._fetch_newsapi(
+                query="россия OR москва OR путин OR россияне OR рубль OR новости",
+                limit=limit,
+                language='ru'
+            ),
+        ])
+
     async def get_russian_financial_news(self, limit: int = 10):
         """Финансовые и рыночные новости РФ — 100% всегда есть"""
         # Убрали lang:ru — он не работает в бесплатной версии
@@ -138,9 +315,112 @@ class NewsService:
                 'OR "центральный банк" OR ЦБ OR "ключевая ставка" OR нефть OR газпром OR санкции ' \
                 'OR инфляция OR ВВП OR бюджет OR "ставка ЦБ" OR "курс доллара" OR "курс евро"' \
                 ')'
-        return await self._fetch_newsapi(query=query, limit=limit, language='ru')
+        return await self._cached_newsapi('russian_financial', query, limit, language='ru')
+
+    def plan_search(self, query: str) -> Tuple[str, str, str]:
+        """
+        Разбор запроса без обращения к API: (запрос для API, нормализованный ключ кэша, язык).
+        Язык определяется по алфавиту: есть кириллица — 'ru', иначе 'en'
+        """
+        api_query = ' '.join(query.split())
+        # Регистр важен только для операторов NewsAPI (OR/AND/NOT), в ключе кэша его нет
+        cache_key = api_query.casefold().replace('ё', 'е')
+
+        # В англоязычных новостях кириллицы не бывает: хоть одно русское слово — ищем на русском
+        language = 'ru' if CYRILLIC_RE.search(api_query) else 'en'
+        return api_query, cache_key, language
+
+    async def search_news(self, query: str, limit: int = 10) -> List[dict]:
+        """
+        Поиск новостей: сначала по локальному индексу, к API — только если там пусто.
+        Язык выбирается заранее (один запрос), популярные запросы — из кэша
+        """
+        api_query, cache_key, language = self.plan_search(query)
+        if not api_query:
+            return []
+
+        if self.index is not None:
+            news = await asyncio.to_thread(self.index.search, api_query, language, limit)
+            if len(news) >= 2:
+                return news
+
+        return await self.search_cache.get_or_fetch(
+            (language, cache_key, limit), self.search_ttl,
+            lambda: self._search_newsapi(api_query, limit, language)
+        )
+
+    async def _search_newsapi(self, query: str, limit: int, language: str) -> List[dict]:
+        news = await self._fetch_newsapi(query=query, limit=limit, language=language)
+        # Найденное через API тоже пригодится следующим поискам
+        if news and self.index is not None:
+            await asyncio.to_thread(self.index.add, news, language)
+        return news
+
+    def _ingest_sources(self) -> List[Callable[[], Awaitable[list]]]:
+        """
+        Те же ленты и с теми же параметрами, что у обработчиков, — ключи кэша общие:
+        свежая лента, которую уже открывали пользователи, не стоит ни одного запроса
+        """
+        return [
+            self.get_latest_financial_news,
+            self.get_us_financial_news,
+            self.get_crypto_news,
+            self.get_economic_news,
+            self.get_banking_news,
+            self.get_russian_top_news,
+            self.get_russian_financial_news,
+        ]
+
+    async def _index_feed(self, key: Hashable, news: list):
+        """Каждая загруженная лента (по запросу пользователя или при сборе) попадает в индекс"""
+        if self.index is not None:
+            await asyncio.to_thread(self.index.add, news, FEED_LANGUAGES.get(key[0], 'en'))
+
+    async def ingest_once(self):
+        """Обновляет устаревшие ленты через общий кэш (в индекс их кладёт _index_feed) и чистит старое"""
+        feeds = await asyncio.gather(*(fetch() for fetch in self._ingest_sources()), return_exceptions=True)
+        for news in feeds:
+            if isinstance(news, Exception):
+                print(f"Ошибка сбора новостей: {news}")
+        await asyncio.to_thread(self.index.purge)
+
+    async def open_index(self):
+        """Подключает локальный индекс для поиска без фонового сбора (для дополнительных процессов)"""
+        if self.index is None:
+            self.index = await asyncio.to_thread(NewsIndex)
+
+    async def start_ingestion(self):
+        await self.open_index()
+        if self._ingest_task is None or self._ingest_task.done():
+            self._ingest_task = asyncio.create_task(self._ingest_loop())
+
+    async def stop_ingestion(self):
+        if self._ingest_task is not None:
+            self._ingest_task.cancel()
+            try:
+                await self._ingest_task
+            except asyncio.CancelledError:
+                pass
+            self._ingest_task = None
+        if self.index is not None:
+            await asyncio.to_thread(self.index.close)
+            self.index = None
+
+    async def _ingest_loop(self):
+        # Индекс лежит на диске и переживает перезапуск — полный проход при старте не нужен,
+        # а ленты, открытые пользователями до первого прохода, индексируются сами
+        while True:
+            await asyncio.sleep(self.ingest_interval * random.uniform(0.9, 1.1))
+            try:
+                await self.ingest_once()
+                print(f"DEBUG: индекс новостей обновлён, статей: {await asyncio.to_thread(len, self.index)}")
+            except Exception as e:
+                print(f"Ошибка фонового сбора новостей: {e}")
 
-    def format_news_message(self, news_items, title: str = "Новости"):
+    def format_news_message(self, news_items, title: str = "Новости", updated_at: Optional[float] = None):
+        """updated_at — время загрузки ленты; по умолчанию берётся из самой ленты (Feed), иначе — сейчас"""
+        if updated_at is None:
+            updated_at = getattr(news_items, 'fetched_at', None) or time.time()
         if not news_items:
             return f"*{title}*\n\nНовости не найдены"
 
@@ -162,6 +442,6 @@ class NewsService:
             message += "\n"
 
         message += f"Всего новостей: {len(news_items)}\n"
-        message += f"Обновлено: {datetime.now().strftime('%d.%m.%Y %H:%M')}\n"
+        message += f"Обновлено: {datetime.fromtimestamp(updated_at).strftime('%d.%m.%Y %H:%M')}\n"
         message += "\n*Нажмите на заголовок для перехода к источнику*"
         return message
\ No newline at end of file
@@ -0,0 +1,156 @@
+# payloads.py
+import json
+from typing import Any, Iterable, List
+
+try:
+    import orjson  # необязательная зависимость: разбирает JSON в разы быстрее stdlib
+except ImportError:
+    orjson = None
+
+loads = orjson.loads if orjson is not None else json.loads
+
+
+async def read_json(response) -> Any:
+    """Тело ответа aiohttp как JSON: сырые байты сразу в парсер, без проверки content-type и декодирования в str"""
+    return loads(await response.read())
+
+
+class Record:
+    """
+    Компактная запись вместо dict на каждый элемент ответа.
+    Поддерживает чтение как у словаря (get / []), чтобы код отображения не менялся
+    """
+
+    __slots__ = ()
+
+    def get(self, key: str, default=None):
+        return getattr(self, key, default)
+
+    def __getitem__(self, key: str):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.__slots__
+
+    def as_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        return cls(**{name: data[name] for name in cls.__slots__ if name in data})
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.as_dict()!r})"
+
+
+class NewsItem(Record):
+    __slots__ = ('title', 'url', 'source', 'published_at', 'currencies')
+
+    def __init__(self, title: str = '', url: str = '', source: str = '', published_at: str = '',
+                 currencies: tuple = ()):
+        self.title = title
+        self.url = url
+        self.source = source
+        self.published_at = published_at
+        self.currencies = currencies
+
+
+class CoinQuote(Record):
+    __slots__ = ('symbol', 'name', 'price', 'change', 'market_cap')
+
+    def __init__(self, symbol: str = '', name: str = '', price: float = 0.0, change: float = 0.0,
+                 market_cap: float = 0.0):
+        self.symbol = symbol
+        self.name = name
+        self.price = price
+        self.change = change
+        self.market_cap = market_cap
+
+
+def _head(items: Any, limit: int) -> Iterable[dict]:
+    """Первые limit элементов списка; до остальных разбор просто не доходит"""
+    if not isinstance(items, list):
+        return ()
+    return (item for item in items[:limit] if isinstance(item, dict))
+
+
+def _float(value) -> float:
+    # API иногда присылают null / false / строки вместо чисел
+    if value is None or value is False:
+        return 0.0
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return 0.0
+
+
+def parse_newsapi(data: dict, limit: int) -> List[NewsItem]:
+    return [
+        NewsItem(
+            a.get('title') or 'Без заголовка',
+            a.get('url') or '',
+            (a.get('source') or {}).get('name') or 'Unknown',
+            a.get('publishedAt') or '',
+        )
+        for a in _head(data.get('articles'), limit)
+    ]
+
+
+def parse_cryptopanic(data: dict, limit: int, domain_of) -> List[NewsItem]:
+    out = []
+    for item in _head(data.get('results'), limit):
+        raw_url = item.get('url') or ''
+        source = (item.get('source') or {}).get('title') or (domain_of(raw_url) if raw_url else 'CryptoPanic')
+        out.append(NewsItem(
+            item.get('title') or '',
+            raw_url,
+            source,
+            item.get('published_at') or '',
+            tuple(c['code'] for c in (item.get('currencies') or [])[:3]),
+        ))
+    return out
+
+
+def parse_coingecko_top(data: list, limit: int) -> List[CoinQuote]:
+    return [
+        CoinQuote(
+            str(coin.get('symbol', '')).upper(),
+            str(coin.get('name', '')),
+            _float(coin.get('current_price')),
+            round(_float(coin.get('price_change_percentage_24h')), 2),
+            _float(coin.get('market_cap')),
+        )
+        for coin in _head(data, limit)
+    ]
+
+
+def parse_cryptocompare_top(data: dict, limit: int) -> List[CoinQuote]:
+    out = []
+    for coin in _head(data.get('Data'), limit):
+        coin_info = coin.get('CoinInfo') or {}
+        raw = (coin.get('RAW') or {}).get('USD') or {}
+        out.append(CoinQuote(
+            coin_info.get('Name', ''),
+            coin_info.get('FullName', ''),
+            _float(raw.get('PRICE')),
+            _float(raw.get('CHANGEPCT24HOUR')),
+            _float(raw.get('MKTCAP')),
+        ))
+    return out
+
+
+def parse_coinmarketcap_top(data: dict, limit: int) -> List[CoinQuote]:
+    out = []
+    for coin in _head(data.get('data'), limit):
+        quote = (coin.get('quote') or {}).get('USD') or {}
+        out.append(CoinQuote(
+            coin.get('symbol', ''),
+            coin.get('name', ''),
+            _float(quote.get('price')),
+            _float(quote.get('percent_change_24h')),
+            _float(quote.get('market_cap')),
+        ))
+    return out
@@ -0,0 +1,88 @@
+# rate_cache.py
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+class RateCache:
+    """In-memory кэш курсов: TTL по источнику, LRU-вытеснение и склейка одинаковых запросов"""
+
+    def __init__(self):
+        self.max_size = int(os.getenv('RATE_CACHE_MAX_SIZE', '1024'))
+        # Фиатные курсы ExchangeRate-API обновляются редко, крипта — постоянно
+        self.fiat_ttl = float(os.getenv('RATE_CACHE_FIAT_TTL', '600'))
+        self.crypto_ttl = float(os.getenv('RATE_CACHE_CRYPTO_TTL', '30'))
+
+        # key -> (время истечения, значение); порядок = порядок использования
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        # key -> задача, которая уже идёт за этим значением к API
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Значение из кэша или None, если его нет или оно протухло"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: float):
+        """Положить значение в кэш на ttl секунд"""
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    async def get_or_fetch(self, key: Hashable, ttl: float, fetcher: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Вернуть значение из кэша, а при промахе — загрузить его через fetcher.
+        Одновременные промахи по одному ключу ждут один и тот же запрос к API.
+        Пустые результаты (None, {}) не кэшируются, чтобы ошибка API не залипала на весь TTL.
+        """
+        value = self.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        self.misses += 1
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch_and_store(key, ttl, fetcher))
+            self._inflight[key] = task
+
+        # shield: отмена одного хендлера не должна отменять запрос для остальных
+        return await asyncio.shield(task)
+
+    async def _fetch_and_store(self, key: Hashable, ttl: float, fetcher: Callable[[], Awaitable[Any]]) -> Any:
+        try:
+            value = await fetcher()
+            if value:
+                self.set(key, value, ttl)
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+    def invalidate(self, key: Optional[Hashable] = None):
+        """Сбросить один ключ или весь кэш"""
+        if key is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,115 @@
+# rate_matrix.py
+import itertools
+import time
+from array import array
+from typing import Dict, Iterable, Optional, Tuple
+
+from data import ALL_CURRENCIES
+
+# Номер версии растёт с каждой новой таблицей — по нему удобно сбрасывать зависимые кэши
+_versions = itertools.count(1)
+
+
+class RateMatrix:
+    """
+    Неизменяемая таблица курсов относительно USD.
+    values[i] — сколько единиц валюты codes[i] дают за 1 USD,
+    поэтому любой кросс-курс считается одной операцией: values[target] / values[base].
+    """
+
+    __slots__ = ('codes', 'index', 'values', 'fiat_codes', 'crypto_codes', 'fetched_at', 'version', 'partial')
+
+    def __init__(self, codes: Tuple[str, ...], values: array, fiat_codes: Tuple[str, ...],
+                 crypto_codes: Tuple[str, ...], fetched_at: float, version: int, partial: bool = False):
+        self.codes = codes
+        self.index = {code: i for i, code in enumerate(codes)}
+        self.values = values
+        self.fiat_codes = fiat_codes
+        self.crypto_codes = crypto_codes
+        self.fetched_at = fetched_at
+        self.version = version
+        # True — часть курсов не обновилась и взята из прошлой таблицы (такой снимок считается устаревшим)
+        self.partial = partial
+
+    @classmethod
+    def build(cls, usd_rates: Dict[str, float], crypto_usd_prices: Dict[str, float],
+              fetched_at: Optional[float] = None, partial: bool = False) -> "RateMatrix":
+        """
+        usd_rates — таблица ExchangeRate-API от USD (1 USD = N валюты),
+        crypto_usd_prices — цены криптовалют в USD (1 BTC = N USD)
+        """
+        units_per_usd: Dict[str, float] = {'USD': 1.0}
+        for code, rate in usd_rates.items():
+            if rate and rate > 0:
+                units_per_usd[code] = float(rate)
+        fiat_codes = tuple(units_per_usd)
+
+        crypto_codes = []
+        for code, price in crypto_usd_prices.items():
+            if price and price > 0:
+                units_per_usd[code] = 1.0 / float(price)
+                crypto_codes.append(code)
+
+        # Сначала валюты бота (стабильный порядок), затем остальные коды из API
+        codes = [code for code in ALL_CURRENCIES if code in units_per_usd]
+        codes += [code for code in units_per_usd if code not in ALL_CURRENCIES]
+
+        return cls(
+            codes=tuple(codes),
+            values=array('d', (units_per_usd[code] for code in codes)),
+            fiat_codes=fiat_codes,
+            crypto_codes=tuple(crypto_codes),
+            fetched_at=fetched_at if fetched_at is not None else time.time(),
+            version=next(_versions),
+            partial=partial
+        )
+
+    @classmethod
+    def restore(cls, codes, values: array, fiat_codes, crypto_codes, fetched_at: float) -> "RateMatrix":
+        """Собрать таблицу из сохранённых на диск частей (см. SnapshotStore)"""
+        return cls(
+            codes=tuple(codes),
+            values=values,
+            fiat_codes=tuple(fiat_codes),
+            crypto_codes=tuple(crypto_codes),
+            fetched_at=fetched_at,
+            version=next(_versions)
+        )
+
+    def usd_rates(self) -> Dict[str, float]:
+        """Фиатная часть таблицы в формате build(): 1 USD = N валюты"""
+        return self.rates_from('USD', self.fiat_codes)
+
+    def crypto_usd_prices(self) -> Dict[str, float]:
+        """Крипто-часть таблицы в формате build(): 1 монета = N USD"""
+        return {code: 1.0 / self.values[self.index[code]] for code in self.crypto_codes}
+
+    def __contains__(self, code: str) -> bool:
+        return code in self.index
+
+    def rate(self, base: str, target: str) -> Optional[float]:
+        """Курс 1 base = N target или None, если одной из валют нет в таблице"""
+        i = self.index.get(base)
+        j = self.index.get(target)
+        if i is None or j is None:
+            return None
+        return self.values[j] / self.values[i]
+
+    def rates_from(self, base: str, targets: Optional[Iterable[str]] = None) -> Dict[str, float]:
+        """Курсы от base ко всем валютам таблицы (или только к targets)"""
+        i = self.index.get(base)
+        if i is None:
+            return {}
+
+        base_value = self.values[i]
+        values = self.values
+        index = self.index
+        if targets is None:
+            targets = self.codes
+
+        result = {}
+        for code in targets:
+            j = index.get(code)
+            if j is not None:
+                result[code] = values[j] / base_value
+        return result
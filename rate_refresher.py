@@ -0,0 +1,78 @@
+# rate_refresher.py
+import asyncio
+import os
+import random
+from typing import Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+class RateRefresher:
+    """Фоновая задача: держит снимок курсов в CurrencyConverter свежим, чтобы хендлеры не ждали API"""
+
+    def __init__(self, converter):
+        self.converter = converter
+
+        self.interval = float(os.getenv('RATE_REFRESH_INTERVAL', '60'))
+        # Разброс ±10%, чтобы несколько процессов бота не били в API одновременно
+        self.jitter = float(os.getenv('RATE_REFRESH_JITTER', '0.1'))
+        self.max_backoff = float(os.getenv('RATE_REFRESH_MAX_BACKOFF', '600'))
+
+        self.failures = 0
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self, follower: bool = False):
+        """
+        Запускает фоновое обновление (первый снимок грузится сразу).
+        follower — дополнительный процесс: в API не ходит, а подхватывает снимок, сохранённый основным
+        """
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._follow() if follower else self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def refresh_once(self) -> bool:
+        """Загружает новый снимок и публикует его; False — если API не ответили"""
+        try:
+            matrix = await self.converter._build_rate_matrix()
+        except Exception as e:
+            print(f"Ошибка фонового обновления курсов: {e}")
+            matrix = None
+
+        if not matrix:
+            return False
+
+        self.converter.publish_snapshot(matrix)
+        await self.converter.save_snapshot()
+        return True
+
+    def _next_delay(self) -> float:
+        if self.failures:
+            # Экспоненциальная пауза после ошибок, чтобы не добивать лежащий API
+            delay = min(self.interval * (2 ** self.failures), self.max_backoff)
+        else:
+            delay = self.interval
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    async def _run(self):
+        while True:
+            if await self.refresh_once():
+                self.failures = 0
+            else:
+                self.failures += 1
+                print(f"DEBUG: снимок курсов не обновлён (ошибок подряд: {self.failures})")
+
+            await asyncio.sleep(self._next_delay())
+
+    async def _follow(self):
+        while True:
+            await asyncio.sleep(self.interval * random.uniform(1 - self.jitter, 1 + self.jitter))
+            await self.converter.follow_snapshot()
@@ -0,0 +1,63 @@
+# render_cache.py
+import os
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+class RenderCache:
+    """
+    Готовые подписи и клавиатуры тяжёлых экранов.
+    Экран зависит только от версии данных (снимка курсов / доски рынка) и параметров
+    (базовая валюта и т.п.) — пока версия та же, повторный показ не форматирует ничего заново.
+    Как только экран запрошен с новой версией, все его старые варианты выбрасываются.
+    """
+
+    def __init__(self, max_size: Optional[int] = None):
+        self.max_size = max_size or int(os.getenv('RENDER_CACHE_MAX_SIZE', '512'))
+        self._entries: "OrderedDict[Tuple[str, Hashable], Any]" = OrderedDict()
+        self._versions: Dict[str, Hashable] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_render(self, screen: str, version: Hashable, params: Hashable, render: Callable[[], Any]) -> Any:
+        """
+        Результат render() для (screen, version, params); version=None — данные без версии, не кэшируем.
+        Пустой результат (None) тоже не кэшируется
+        """
+        if version is None:
+            return render()
+
+        if self._versions.get(screen) != version:
+            self.invalidate(screen)
+            self._versions[screen] = version
+
+        key = (screen, params)
+        value = self._entries.get(key)
+        if value is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+        self.misses += 1
+        value = render()
+        if value is not None:
+            self._entries[key] = value
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return value
+
+    def invalidate(self, screen: Optional[str] = None):
+        """Сбрасывает один экран или весь кэш"""
+        if screen is None:
+            self._entries.clear()
+            self._versions.clear()
+            return
+        for key in [key for key in self._entries if key[0] == screen]:
+            del self._entries[key]
+        self._versions.pop(screen, None)
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,226 @@
+# send_scheduler.py
+import asyncio
+import itertools
+import os
+import time
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+from dotenv import load_dotenv
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+load_dotenv()
+
+# Приоритеты: чем меньше число, тем раньше запрос уходит в Telegram
+PRIORITY_USER = 0
+PRIORITY_BACKGROUND = 1
+
+# Приоритет запросов текущей задачи. По умолчанию — пользовательский; фоновые задачи
+# (уборка старых сообщений, см. MessageCleaner.delete_in_background) ставят PRIORITY_BACKGROUND у себя.
+# Тип метода тут не подсказка: удаление, которого ждёт хендлер, — тоже ответ пользователю
+request_priority: ContextVar[int] = ContextVar('request_priority', default=PRIORITY_USER)
+
+# Лимит Telegram "около 1 сообщения в секунду на чат" касается только новых сообщений:
+# удаления, правки и ответы на callback идут лишь через общий bucket, иначе каждая смена экрана
+# (удалить старое + отправить новое) съедала бы токены чата и навигация тормозила бы
+CHAT_LIMITED_METHODS = ('copyMessage', 'copyMessages', 'forwardMessage', 'forwardMessages')
+
+
+def is_chat_limited(method) -> bool:
+    api_method = getattr(method, '__api_method__', '')
+    return api_method.startswith('send') or api_method in CHAT_LIMITED_METHODS
+
+
+class TokenBucket:
+    """Классический token bucket: rate токенов в секунду, не больше capacity про запас"""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated', 'blocked_until')
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        # До этого момента Telegram просил не слать (retry_after)
+        self.blocked_until = 0.0
+
+    def delay(self, now: float) -> float:
+        """Сколько ждать до следующего токена (0 — можно слать сейчас)"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def block(self, now: float, seconds: float):
+        self.blocked_until = max(self.blocked_until, now + seconds)
+        self.tokens = 0
+
+
+class _Waiter:
+    __slots__ = ('priority', 'seq', 'chat_id', 'future', 'enqueued_at')
+
+    def __init__(self, priority: int, seq: int, chat_id, future: asyncio.Future):
+        self.priority = priority
+        self.seq = seq
+        self.chat_id = chat_id
+        self.future = future
+        self.enqueued_at = time.monotonic()
+
+
+class SendScheduler(BaseRequestMiddleware):
+    """
+    Middleware сессии бота: все исходящие запросы к Telegram проходят через
+    общий token bucket (TELEGRAM_GLOBAL_RATE в секунду), а отправки сообщений — ещё и bucket своего чата
+    (TELEGRAM_CHAT_RATE).
+    Ответы пользователю обгоняют фоновые удаления; на 429 запрос ждёт retry_after и повторяется,
+    а чат (или весь бот) на это время ставится на паузу.
+
+    Лимиты считаются внутри процесса. Если бот запущен в processes процессах (webhook с SO_REUSEPORT),
+    каждый получает свою долю: 1/processes от общего и от чатового лимита, иначе в сумме они умножатся.
+    """
+
+    def __init__(self, processes: int = 1):
+        self.processes = max(1, processes)
+        self.global_rate = float(os.getenv('TELEGRAM_GLOBAL_RATE', '30')) / self.processes
+        self.chat_rate = float(os.getenv('TELEGRAM_CHAT_RATE', '1')) / self.processes
+        self.chat_burst = max(1.0, float(os.getenv('TELEGRAM_CHAT_BURST', '3')) / self.processes)
+        self.max_retries = int(os.getenv('TELEGRAM_MAX_RETRIES', '3'))
+        self.max_tracked_chats = int(os.getenv('TELEGRAM_MAX_TRACKED_CHATS', '10000'))
+
+        self.global_bucket = TokenBucket(self.global_rate, self.global_rate)
+        self._chat_buckets: Dict[int, TokenBucket] = {}
+        self._queue: List[_Waiter] = []
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+        self._metrics = {
+            'requests': 0,
+            'waited': 0,
+            'wait_seconds_total': 0.0,
+            'wait_seconds_max': 0.0,
+            'queue_depth_max': 0,
+            'retry_after': 0,
+        }
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, 'chat_id', None)
+        limited_chat_id = chat_id if is_chat_limited(method) else None
+        priority = request_priority.get()
+
+        for attempt in range(self.max_retries + 1):
+            await self.acquire(limited_chat_id, priority)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                self._metrics['retry_after'] += 1
+                bucket = self._chat_bucket(chat_id) if chat_id is not None else self.global_bucket
+                bucket.block(time.monotonic(), e.retry_after)
+                print(f"Telegram просит подождать {e.retry_after} с ({type(method).__name__}, чат {chat_id})")
+                if attempt == self.max_retries:
+                    raise
+                if chat_id is not None and limited_chat_id is None:
+                    # Bucket чата этот запрос не проверяет — паузу выдерживаем сами
+                    await asyncio.sleep(e.retry_after)
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) >= self.max_tracked_chats:
+                self._forget_idle_chats()
+            bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    async def acquire(self, chat_id=None, priority: int = PRIORITY_USER):
+        """Ждёт своей очереди на отправку запроса"""
+        self._metrics['requests'] += 1
+        now = time.monotonic()
+
+        # Быстрый путь: очередь пуста и токены есть — без переключений задач
+        if not self._queue and self.global_bucket.delay(now) == 0:
+            chat_bucket = self._chat_bucket(chat_id) if chat_id is not None else None
+            if chat_bucket is None or chat_bucket.delay(now) == 0:
+                self.global_bucket.take()
+                if chat_bucket is not None:
+                    chat_bucket.take()
+                return
+
+        waiter = _Waiter(priority, next(self._seq), chat_id, asyncio.get_running_loop().create_future())
+        self._queue.append(waiter)
+        self._metrics['queue_depth_max'] = max(self._metrics['queue_depth_max'], len(self._queue))
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        self._wakeup.set()
+
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter in self._queue:
+                self._queue.remove(waiter)
+            raise
+
+        waited = time.monotonic() - waiter.enqueued_at
+        self._metrics['waited'] += 1
+        self._metrics['wait_seconds_total'] += waited
+        self._metrics['wait_seconds_max'] = max(self._metrics['wait_seconds_max'], waited)
+
+    async def _run(self):
+        while self._queue:
+            now = time.monotonic()
+            delay = self.global_bucket.delay(now)
+
+            if delay == 0:
+                # Первый по приоритету запрос, чей чат не упёрся в лимит; занятые чаты не держат остальных
+                self._queue.sort(key=lambda w: (w.priority, w.seq))
+                delay = float('inf')
+                for waiter in self._queue:
+                    chat_bucket = self._chat_bucket(waiter.chat_id) if waiter.chat_id is not None else None
+                    chat_delay = chat_bucket.delay(now) if chat_bucket is not None else 0.0
+                    if chat_delay == 0:
+                        self._queue.remove(waiter)
+                        self.global_bucket.take()
+                        if chat_bucket is not None:
+                            chat_bucket.take()
+                        if not waiter.future.done():
+                            waiter.future.set_result(None)
+                        delay = 0.0
+                        break
+                    delay = min(delay, chat_delay)
+
+            if delay > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+
+        self._forget_idle_chats()
+
+    def _forget_idle_chats(self):
+        """Полные bucket'ы без паузы ничего не ограничивают — их можно выбросить"""
+        now = time.monotonic()
+        for chat_id, bucket in list(self._chat_buckets.items()):
+            if bucket.delay(now) == 0 and bucket.tokens >= bucket.capacity:
+                del self._chat_buckets[chat_id]
+
+    def metrics(self) -> dict:
+        """Глубина очереди и время ожидания отправки"""
+        waited = self._metrics['waited']
+        return dict(
+            self._metrics,
+            queue_depth=len(self._queue),
+            queue_depth_by_priority={
+                'user': sum(1 for w in self._queue if w.priority == PRIORITY_USER),
+                'background': sum(1 for w in self._queue if w.priority == PRIORITY_BACKGROUND),
+            },
+            wait_seconds_avg=self._metrics['wait_seconds_total'] / waited if waited else 0.0,
+            chats_tracked=len(self._chat_buckets),
+        )
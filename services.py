@@ -1,15 +1,303 @@
-import requests
-import aiohttp
 from datetime import datetime
 from data import CURRENCIES, CRYPTOCURRENCIES
 import asyncio
-from typing import Optional, Dict, Any
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Optional, Dict, Any, Tuple
 import os
 from dotenv import load_dotenv
 
+from http_client import http_client
+from payloads import CoinQuote, read_json, parse_coingecko_top, parse_cryptocompare_top, parse_coinmarketcap_top
+from rate_cache import RateCache
+from rate_matrix import RateMatrix
+from snapshot_store import SnapshotStore
+
 
 load_dotenv()
 
+# Фиатные валюты, к которым крипта котируется напрямую в пакетном запросе
+CRYPTO_QUOTE_TARGETS = ['USD', 'EUR', 'RUB', 'GBP', 'JPY']
+
+
+@dataclass(frozen=True)
+class ConversionResult:
+    """Результат конвертации — сумма и курс получены из одного и того же запроса"""
+    amount: float
+    base_currency: str
+    target_currency: str
+    result: float
+    rate: float
+    inverse: float
+    source: str
+    timestamp: float
+
+
+class ProviderError(Exception):
+    """Источник ответил ошибкой или пустыми данными"""
+
+
+class RateProvider:
+    """
+    Базовый класс источника данных.
+    Считает здоровье (EWMA успехов), EWMA и p95 задержки и держит circuit breaker:
+    после нескольких ошибок подряд источник временно пропускается.
+    """
+
+    name = 'base'
+
+    def __init__(self):
+        self.failure_threshold = int(os.getenv('PROVIDER_FAILURE_THRESHOLD', '3'))
+        self.cooldown = float(os.getenv('PROVIDER_COOLDOWN', '60'))
+
+        self.health = 1.0
+        self.latency_ewma: Optional[float] = None
+        self._latencies = deque(maxlen=50)
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+
+    def is_available(self) -> bool:
+        """False, пока circuit breaker открыт"""
+        return time.monotonic() >= self.open_until
+
+    def record_success(self, latency: float):
+        self.health = self.health * 0.8 + 0.2
+        self.latency_ewma = latency if self.latency_ewma is None else self.latency_ewma * 0.8 + latency * 0.2
+        self._latencies.append(latency)
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+
+    def record_failure(self):
+        self.health = self.health * 0.8
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= self.failure_threshold:
+            # Каждое следующее срабатывание держит источник выключенным дольше (до 10 минут)
+            extra = self.consecutive_failures - self.failure_threshold
+            self.open_until = time.monotonic() + min(self.cooldown * (2 ** extra), 600)
+
+    def p95(self) -> Optional[float]:
+        """95-й перцентиль задержки или None, пока замеров мало"""
+        if len(self._latencies) < 5:
+            return None
+        ordered = sorted(self._latencies)
+        return ordered[int(len(ordered) * 0.95) - 1]
+
+    def score(self) -> float:
+        """Чем выше, тем раньше источник пробуется"""
+        return self.health / (self.latency_ewma or 1.0)
+
+    async def _get_json(self, url: str, params=None, headers=None, timeout: float = 10):
+        session = http_client.get_session()
+        async with session.get(url, params=params, headers=headers, timeout=timeout) as response:
+            if response.status != 200:
+                raise ProviderError(f"HTTP {response.status}")
+            return await read_json(response)
+
+
+class ExchangeRateApiProvider(RateProvider):
+    """ExchangeRate-API v6 (нужен EXCHANGE_RATE_API_KEY)"""
+
+    name = 'ExchangeRate-API'
+
+    def __init__(self, api_key: str):
+        super().__init__()
+        self.base_url = f"https://v6.exchangerate-api.com/v6/{api_key}/"
+
+    async def fetch_fiat_table(self, base: str) -> Dict[str, float]:
+        data = await self._get_json(f"{self.base_url}latest/{base}", timeout=15)
+        if data.get('result') != 'success':
+            raise ProviderError(data.get('error-type', 'Неизвестная ошибка'))
+        return data.get('conversion_rates', {})
+
+
+class OpenExchangeRateProvider(RateProvider):
+    """Бесплатный endpoint open.er-api.com — запасной фиатный источник без ключа"""
+
+    name = 'open.er-api'
+
+    async def fetch_fiat_table(self, base: str) -> Dict[str, float]:
+        data = await self._get_json(f"https://open.er-api.com/v6/latest/{base}", timeout=15)
+        if data.get('result') != 'success':
+            raise ProviderError(data.get('error-type', 'Неизвестная ошибка'))
+        return data.get('rates', {})
+
+
+class CryptoCompareProvider(RateProvider):
+    name = 'CryptoCompare'
+
+    def __init__(self, api_key: Optional[str]):
+        super().__init__()
+        self.api_key = api_key or ''
+
+    async def fetch_crypto_quotes(self, symbols, targets) -> Dict[str, Dict[str, float]]:
+        data = await self._get_json(
+            "https://min-api.cryptocompare.com/data/pricemulti",
+            params={'fsyms': ','.join(symbols), 'tsyms': ','.join(targets), 'api_key': self.api_key}
+        )
+        if data.get('Response') == 'Error':
+            raise ProviderError(data.get('Message'))
+
+        return {
+            symbol: {target: price for target, price in row.items() if price}
+            for symbol, row in data.items()
+            if isinstance(row, dict)
+        }
+
+    async def fetch_top(self, limit: int) -> list:
+        data = await self._get_json(
+            "https://min-api.cryptocompare.com/data/top/mktcapfull",
+            params={'limit': limit, 'tsym': 'USD', 'api_key': self.api_key}
+        )
+        return parse_cryptocompare_top(data, limit)
+
+
+class CoinGeckoProvider(RateProvider):
+    """CoinGecko — работает без ключей"""
+
+    name = 'CoinGecko'
+
+    # ID CoinGecko для наших криптовалют (сопоставлены с CRYPTOCURRENCIES)
+    COINGECKO_IDS = {
+        'BTC': 'bitcoin', 'ETH': 'ethereum', 'BNB': 'binancecoin', 'XRP': 'ripple',
+        'SOL': 'solana', 'ADA': 'cardano', 'DOGE': 'dogecoin', 'DOT': 'polkadot',
+        'MATIC': 'matic-network', 'SHIB': 'shiba-inu', 'AVAX': 'avalanche-2', 'LTC': 'litecoin',
+        'LINK': 'chainlink', 'UNI': 'uniswap', 'ATOM': 'cosmos', 'USDT': 'tether',
+        'USDC': 'usd-coin', 'DAI': 'dai', 'TRX': 'tron', 'XLM': 'stellar', 'ALGO': 'algorand',
+        'VET': 'vechain', 'XTZ': 'tezos', 'FIL': 'filecoin', 'EOS': 'eos', 'AAVE': 'aave',
+        'SAND': 'the-sandbox', 'MANA': 'decentraland', 'AXS': 'axie-infinity'
+    }
+
+    async def fetch_crypto_quotes(self, symbols, targets) -> Dict[str, Dict[str, float]]:
+        ids = {self.COINGECKO_IDS[symbol]: symbol for symbol in symbols if symbol in self.COINGECKO_IDS}
+        if not ids:
+            return {}
+
+        data = await self._get_json(
+            "https://api.coingecko.com/api/v3/simple/price",
+            params={'ids': ','.join(ids), 'vs_currencies': ','.join(targets).lower()}
+        )
+
+        quotes = {}
+        for coingecko_id, row in data.items():
+            symbol = ids.get(coingecko_id)
+            if symbol and isinstance(row, dict):
+                quotes[symbol] = {target: row[target.lower()] for target in targets if row.get(target.lower())}
+        return quotes
+
+    async def fetch_top(self, limit: int) -> list:
+        """CoinGecko с полной защитой от False/null и правильными % за 24ч"""
+        params = {
+            'vs_currency': 'usd',
+            'order': 'market_cap_desc',
+            'per_page': str(limit),  # int → str для безопасности
+            'page': '1',
+            'sparkline': 'false',  # bool → str
+            'price_change_percentage': '24h'  # всегда str
+        }
+
+        data = await self._get_json("https://api.coingecko.com/api/v3/coins/markets", params=params, timeout=15)
+        if not isinstance(data, list) or not data:
+            raise ProviderError("пустой ответ")
+
+        # Безопасная обработка null / False в цене и % за 24ч — в parse_coingecko_top
+        return parse_coingecko_top(data, limit)
+
+
+class CoinMarketCapProvider(RateProvider):
+    """CoinMarketCap (нужен COINMARKETCAP_API_KEY)"""
+
+    name = 'CoinMarketCap'
+
+    def __init__(self, api_key: str):
+        super().__init__()
+        self.api_key = api_key
+
+    async def fetch_top(self, limit: int) -> list:
+        headers = {
+            'X-CMC_PRO_API_KEY': self.api_key,
+            'Accept': 'application/json'
+        }
+        params = {
+            'start': '1',
+            'limit': str(limit),
+            'convert': 'USD'
+        }
+
+        data = await self._get_json(
+            "https://pro-api.coinmarketcap.com/v1/cryptocurrency/listings/latest",
+            params=params, headers=headers
+        )
+        return parse_coinmarketcap_top(data, limit)
+
+
+class ProviderPool:
+    """
+    Группа взаимозаменяемых источников.
+    Пробует самый здоровый и быстрый; если он не ответил за свой p95 — параллельно
+    запускает следующий (hedged request) и берёт первый непустой ответ.
+    Источники с открытым circuit breaker пропускаются.
+    """
+
+    def __init__(self, providers):
+        self.providers = list(providers)
+        self.hedge_delay = float(os.getenv('PROVIDER_HEDGE_DELAY', '2'))
+        self.max_parallel = int(os.getenv('PROVIDER_MAX_PARALLEL', '2'))
+        # Имя источника, давшего последний удачный ответ
+        self.last_provider: Optional[str] = None
+
+    def _ranked(self) -> list:
+        # sorted стабилен: при равном счёте сохраняется порядок из конфигурации
+        available = [provider for provider in self.providers if provider.is_available()]
+        return sorted(available, key=lambda provider: provider.score(), reverse=True)
+
+    def _hedge_delay_for(self, provider: RateProvider) -> float:
+        p95 = provider.p95()
+        return max(p95, 0.2) if p95 is not None else self.hedge_delay
+
+    async def _call(self, provider: RateProvider, method: str, *args):
+        started = time.monotonic()
+        try:
+            value = await getattr(provider, method)(*args)
+            if not value:
+                raise ProviderError("пустой ответ")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            provider.record_failure()
+            print(f"Ошибка {provider.name}: {e}")
+            return None
+
+        provider.record_success(time.monotonic() - started)
+        return value
+
+    async def fetch(self, method: str, *args):
+        """Результат первого источника, вернувшего непустые данные, или None"""
+        queue = self._ranked()
+        pending = set()
+        started = {}
+        try:
+            while queue or pending:
+                if queue and len(pending) < self.max_parallel:
+                    provider = queue.pop(0)
+                    task = asyncio.ensure_future(self._call(provider, method, *args))
+                    started[task] = provider
+                    pending.add(task)
+                    timeout = self._hedge_delay_for(provider) if queue else None
+                else:
+                    timeout = None
+
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    value = task.result()
+                    if value:
+                        self.last_provider = started[task].name
+                        return value
+            return None
+        finally:
+            for task in pending:
+                task.cancel()
+
 
 class CurrencyConverter:
     def __init__(self):
@@ -22,10 +310,43 @@ class CurrencyConverter:
         print(f"DEBUG: CryptoCompare key: {'ЕСТЬ' if self.cryptocompare_key else 'НЕТ'}")
         print(f"DEBUG: CoinMarketCap key: {'ЕСТЬ' if self.coinmarketcap_key else 'НЕТ'}")
 
-        self.base_url = f"https://v6.exchangerate-api.com/v6/{self.api_key}/" if self.api_key else None
+        # Источники данных: порядок — приоритет при равном здоровье
+        crypto_compare = CryptoCompareProvider(self.cryptocompare_key)
+        coingecko = CoinGeckoProvider()
+
+        fiat_providers = [OpenExchangeRateProvider()]
+        if self.api_key:
+            fiat_providers.insert(0, ExchangeRateApiProvider(self.api_key))
+        top_providers = [crypto_compare, coingecko] if self.cryptocompare_key else [coingecko, crypto_compare]
+        if self.coinmarketcap_key:
+            top_providers.insert(0, CoinMarketCapProvider(self.coinmarketcap_key))
+
+        self.fiat_providers = ProviderPool(fiat_providers)
+        self.crypto_providers = ProviderPool([crypto_compare, coingecko])
+        self.top_providers = ProviderPool(top_providers)
+
+        # Кэш курсов: ('matrix',), ('pair', base, target) и ('all', base)
+        self.rate_cache = RateCache()
+
+        # Снимок, который публикует фоновый RateRefresher; хендлеры читают только его
+        self.snapshot: Optional[RateMatrix] = None
+        self.stale_after = float(os.getenv('RATE_STALE_AFTER', '300'))
+        # True, пока работаем на снимке с диска и первое обновление ещё не прошло
+        self.snapshot_restored = False
+
+        # Последний удачный топ криптовалют (тоже сохраняется на диск)
+        self.top_crypto: list = []
+        self.top_crypto_fetched_at: Optional[float] = None
+
+        self.snapshot_store = SnapshotStore()
 
     async def get_exchange_rate(self, base_currency: str, target_currency: str) -> Optional[float]:
         """Получить курс обмена между двумя валютами"""
+        quote = await self._lookup_rate(base_currency, target_currency)
+        return quote[0] if quote else None
+
+    async def _lookup_rate(self, base_currency: str, target_currency: str) -> Optional[Tuple[float, str, float]]:
+        """Курс вместе с источником и временем получения: (rate, source, timestamp)"""
         base = base_currency.upper()
         target = target_currency.upper()
 
@@ -37,54 +358,191 @@ class CurrencyConverter:
             target = 'USD'
 
         try:
-            # Для криптовалют используем CryptoCompare (теперь стейблкоины исключены)
+            # Прямая котировка крипты из последнего пакетного запроса точнее кросс-курса
             if self._is_crypto(base) or self._is_crypto(target):
-                return await self._get_crypto_rate_cryptocompare(base, target)
-
-            # Для фиатных валют используем ExchangeRate-API
-            if not self.base_url:
-                return None
-
-            url = f"{self.base_url}pair/{base}/{target}"
-            response = requests.get(url, timeout=10)
-            data = response.json()
-
-            if data.get('result') == 'success':
-                rate = data.get('conversion_rate')
-                print(f"DEBUG: {base} → {target} = {rate}")  # Для отладки
-                return rate
-            else:
-                print(f"Ошибка ExchangeRate API: {data.get('error-type', 'Неизвестная ошибка')}")
-                return None
+                rate = self.rate_cache.get(('pair', base, target))
+                if rate:
+                    return rate, self.crypto_providers.last_provider or 'cache', time.time()
+
+            # Кросс-курс из общей таблицы — без отдельного запроса на каждую пару
+            matrix = await self.get_rate_matrix()
+            if matrix:
+                rate = matrix.rate(base, target)
+                if rate:
+                    return rate, 'matrix', matrix.fetched_at
+
+            # Пары нет в таблице — запрашиваем её напрямую
+            # Для криптовалют используем пакетные котировки (стейблкоины исключены)
+            if self._is_crypto(base):
+                quotes = await self.get_crypto_quotes([base], [target])
+                rate = quotes.get(base, {}).get(target)
+                return (rate, self.crypto_providers.last_provider, time.time()) if rate else None
+            if self._is_crypto(target):
+                quotes = await self.get_crypto_quotes([target], [base])
+                price = quotes.get(target, {}).get(base)
+                return (1 / price, self.crypto_providers.last_provider, time.time()) if price else None
+
+            # Для фиатных валют берём таблицу от base у фиатных источников
+            rates = await self.rate_cache.get_or_fetch(
+                ('all', base),
+                self.rate_cache.fiat_ttl,
+                lambda: self._fetch_all_rates(base)
+            )
+            rate = rates.get(target) if rates else None
+            return (rate, self.fiat_providers.last_provider, time.time()) if rate else None
 
         except Exception as e:
             print(f"Ошибка при получении курса: {e}")
             return None
 
-    async def _get_crypto_rate_cryptocompare(self, base: str, target: str) -> Optional[float]:
-        """Получить курс криптовалюты через CryptoCompare"""
+    def publish_snapshot(self, matrix: RateMatrix, restored: bool = False):
+        """Подменяет текущий снимок курсов целиком (сам снимок неизменяемый)"""
+        self.snapshot = matrix
+        self.snapshot_restored = restored
+
+    def is_snapshot_stale(self) -> bool:
+        """True, если снимка нет, он загружен с диска или фоновое обновление давно не удавалось"""
+        if self.snapshot is None or self.snapshot_restored or self.snapshot.partial:
+            return True
+        return time.time() - self.snapshot.fetched_at > self.stale_after
+
+    async def restore_snapshot(self) -> bool:
+        """Поднимает последний снимок с диска при старте — до первого обновления он помечен устаревшим"""
+        return await self._load_snapshot(restored=True)
+
+    async def follow_snapshot(self) -> bool:
+        """
+        Для дополнительных процессов, которые сами в API не ходят: подхватывает снимок,
+        сохранённый основным процессом, если он новее текущего
+        """
+        return await self._load_snapshot(restored=False)
+
+    async def _load_snapshot(self, restored: bool) -> bool:
         try:
-            url = "https://min-api.cryptocompare.com/data/price"
-            params = {
-                'fsym': base,
-                'tsyms': target,
-                'api_key': self.cryptocompare_key if self.cryptocompare_key else ''
-            }
-
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, params=params, timeout=10) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        if target in data:
-                            return data[target]
-                    else:
-                        print(f"Ошибка CryptoCompare: {response.status}")
-            return None
+            saved = await asyncio.to_thread(self.snapshot_store.load)
+        except Exception as e:
+            print(f"Ошибка загрузки снимка курсов: {e}")
+            return False
+
+        updated = False
+        if 'matrix' in saved:
+            matrix = RateMatrix.restore(**saved['matrix'])
+            if self.snapshot is None or (not restored and matrix.fetched_at > self.snapshot.fetched_at):
+                self.publish_snapshot(matrix, restored=restored)
+                updated = True
+
+        # Котировки пар в rate_cache с диска не поднимаем: там они выглядели бы только что полученными.
+        # Крипта до первого обновления считается по восстановленной таблице — с её настоящим fetched_at
+
+        if 'top_crypto' in saved:
+            fetched_at, top_crypto = saved['top_crypto']
+            if not self.top_crypto or (not restored and fetched_at > (self.top_crypto_fetched_at or 0)):
+                self.top_crypto_fetched_at = fetched_at
+                self.top_crypto = [CoinQuote.from_dict(coin) for coin in top_crypto]
+                updated = True
+
+        if saved and restored:
+            print(f"DEBUG: снимок курсов загружен с диска ({', '.join(saved)})")
+        return updated
+
+    async def save_snapshot(self):
+        """Сохраняет текущий снимок и топ на диск (в отдельном потоке)"""
+        # Неполный снимок не должен затереть на диске последний целый
+        if self.snapshot is None or self.snapshot_restored or self.snapshot.partial:
+            return
 
+        try:
+            await asyncio.to_thread(
+                self.snapshot_store.save,
+                self.snapshot, self.top_crypto, self.top_crypto_fetched_at
+            )
         except Exception as e:
-            print(f"Ошибка CryptoCompare: {e}")
+            print(f"Ошибка сохранения снимка курсов: {e}")
+
+    async def get_rate_matrix(self) -> Optional[RateMatrix]:
+        """Таблица курсов всех валют относительно USD (одна фиатная таблица + один запрос по крипте)"""
+        # Есть фоновый снимок — отдаём его сразу, даже устаревший, без похода в API
+        if self.snapshot is not None:
+            return self.snapshot
+
+        return await self.rate_cache.get_or_fetch(
+            ('matrix',),
+            self.rate_cache.crypto_ttl,
+            self._build_rate_matrix
+        )
+
+    async def _build_rate_matrix(self) -> Optional[RateMatrix]:
+        # Фиатная таблица кэшируется отдельно и живёт дольше, чем цены крипты
+        usd_rates = await self.rate_cache.get_or_fetch(
+            ('all', 'USD'),
+            self.rate_cache.fiat_ttl,
+            lambda: self._fetch_all_rates('USD')
+        )
+        # Один запрос: все криптовалюты сразу к USD, EUR, RUB, GBP, JPY
+        quotes = await self._fetch_crypto_quotes(list(CRYPTOCURRENCIES), CRYPTO_QUOTE_TARGETS)
+        crypto_prices = {symbol: row['USD'] for symbol, row in quotes.items() if row.get('USD')}
+
+        if not usd_rates and not crypto_prices:
             return None
 
+        # Одна из частей не загрузилась — берём её из прошлого снимка, а сам снимок помечаем неполным
+        partial = not usd_rates or not crypto_prices
+        if partial:
+            print(f"DEBUG: не загружены {'фиатные курсы' if not usd_rates else 'цены криптовалют'}, "
+                  f"оставляю прошлые значения")
+            if self.snapshot is not None:
+                usd_rates = usd_rates or self.snapshot.usd_rates()
+                crypto_prices = crypto_prices or self.snapshot.crypto_usd_prices()
+        return RateMatrix.build(usd_rates or {}, crypto_prices, partial=partial)
+
+    async def get_crypto_quotes(self, symbols=None, targets=None) -> Dict[str, Dict[str, float]]:
+        """
+        Котировки {symbol: {target: price}} для нескольких криптовалют сразу.
+        Что уже есть в кэше или в снимке курсов — берётся оттуда (котировки в кэше живут меньше
+        интервала фонового обновления, снимок — до следующего), остальное добирается ОДНИМ запросом pricemulti.
+        """
+        symbols = [symbol.upper() for symbol in (symbols or CRYPTOCURRENCIES)]
+        targets = [target.upper() for target in (targets or CRYPTO_QUOTE_TARGETS)]
+
+        quotes = {}
+        missing = []
+        matrix = self.snapshot
+        for symbol in symbols:
+            row = {}
+            for target in targets:
+                price = self.rate_cache.get(('pair', symbol, target))
+                if not price and matrix is not None:
+                    price = matrix.rate(symbol, target)
+                if price:
+                    row[target] = price
+            if len(row) == len(targets):
+                quotes[symbol] = row
+            else:
+                missing.append(symbol)
+
+        if missing:
+            fetched = await self.rate_cache.get_or_fetch(
+                ('quotes', tuple(missing), tuple(targets)),
+                self.rate_cache.crypto_ttl,
+                lambda: self._fetch_crypto_quotes(missing, targets)
+            )
+            quotes.update(fetched or {})
+
+        return quotes
+
+    async def _fetch_crypto_quotes(self, symbols, targets) -> Dict[str, Dict[str, float]]:
+        """Пакетный запрос котировок у крипто-источников; результат раскладывается в кэш по парам"""
+        quotes = await self.crypto_providers.fetch('fetch_crypto_quotes', list(symbols), list(targets))
+        if not quotes:
+            return {}
+
+        ttl = self.rate_cache.crypto_ttl
+        for symbol, row in quotes.items():
+            for target, price in row.items():
+                self.rate_cache.set(('pair', symbol, target), price, ttl)
+                self.rate_cache.set(('pair', target, symbol), 1 / price, ttl)
+        return quotes
+
     def _is_crypto(self, currency_code: str) -> bool:
         """Проверить, является ли валюта криптовалютой"""
         crypto_codes = ['BTC', 'ETH', 'BNB', 'XRP', 'SOL', 'ADA', 'DOGE', 'USDT',
@@ -94,191 +552,16 @@ class CurrencyConverter:
         return currency_code.upper() in crypto_codes
 
     async def get_top_cryptocurrencies(self, limit: int = 10) -> list:
-        """Актуальный топ из CoinGecko — реал-тайм, без ключей"""
-        try:
-            # Список ID CoinGecko для твоих криптовалют (сопоставь с CRYPTOCURRENCIES)
-            coingecko_ids = {
-                'BTC': 'bitcoin', 'ETH': 'ethereum', 'BNB': 'binancecoin', 'XRP': 'ripple',
-                'SOL': 'solana', 'ADA': 'cardano', 'DOGE': 'dogecoin', 'DOT': 'polkadot',
-                'MATIC': 'polygon', 'SHIB': 'shiba-inu', 'AVAX': 'avalanche-2', 'LTC': 'litecoin',
-                'LINK': 'chainlink', 'UNI': 'uniswap', 'ATOM': 'cosmos', 'USDT': 'tether',
-                'USDC': 'usd-coin', 'DAI': 'dai', 'TRX': 'tron', 'XLM': 'stellar', 'ALGO': 'algorand',
-                'VET': 'vechain', 'XTZ': 'tezos', 'FIL': 'filecoin', 'EOS': 'eos', 'AAVE': 'aave',
-                'SAND': 'the-sandbox', 'MANA': 'decentraland', 'AXS': 'axie-infinity'
-            }
-
-            # Собираем IDs для твоих крипт (топ-10 по умолчанию)
-            ids = ','.join(coingecko_ids.values()[:limit])
-
-            async with aiohttp.ClientSession() as session:
-                url = f"https://api.coingecko.com/api/v3/simple/price?ids={ids}&vs_currencies=usd,rub&include_24hr_change=true"
-                async with session.get(url, timeout=10) as resp:
-                    if resp.status == 200:
-                        data = await resp.json()
-                        top_crypto = []
-                        for symbol, coingecko_id in list(coingecko_ids.items())[:limit]:
-                            if coingecko_id in data:
-                                coin_data = data[coingecko_id]
-                                name = CRYPTOCURRENCIES.get(symbol, symbol)
-                                top_crypto.append({
-                                    'symbol': symbol,
-                                    'name': name,
-                                    'price': coin_data['usd'],  # USD
-                                    'rub_price': coin_data['rub'],  # RUB для твоего бота
-                                    'change': coin_data['usd_24h_change']  # Изменение в %
-                                })
-                        print(f"✅ CoinGecko: Получено {len(top_crypto)} актуальных курсов")
-                        return top_crypto
-                    else:
-                        print(f"Ошибка CoinGecko: {resp.status}")
-                        return self._get_mock_crypto_data()
-        except Exception as e:
-            print(f"Ошибка CoinGecko: {e}")
-            return self._get_mock_crypto_data()
-
-        # try:
-        #     if self.coinmarketcap_key:
-        #         return await self._get_top_crypto_coinmarketcap(limit)
-        #     elif self.cryptocompare_key:
-        #         return await self._get_top_crypto_cryptocompare(limit)
-        #     else:
-        #         return await self._get_top_crypto_coingecko(limit)
-        # except:
-        #     return self._get_mock_crypto_data()
-
-    async def _get_top_crypto_coinmarketcap(self, limit: int) -> list:
-        """Используем CoinMarketCap API"""
-        try:
-            url = "https://pro-api.coinmarketcap.com/v1/cryptocurrency/listings/latest"
-            headers = {
-                'X-CMC_PRO_API_KEY': self.coinmarketcap_key,
-                'Accept': 'application/json'
-            }
-            params = {
-                'start': '1',
-                'limit': str(limit),
-                'convert': 'USD'
-            }
-
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, headers=headers, params=params, timeout=10) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        top_crypto = []
-
-                        for coin in data.get('data', []):
-                            quote = coin.get('quote', {}).get('USD', {})
-                            top_crypto.append({
-                                'symbol': coin.get('symbol', ''),
-                                'name': coin.get('name', ''),
-                                'price': quote.get('price', 0),
-                                'change': quote.get('percent_change_24h', 0),
-                                'market_cap': quote.get('market_cap', 0)
-                            })
-
-                        return top_crypto
-            return []
-
-        except Exception as e:
-            print(f"Ошибка CoinMarketCap: {e}")
-            return []
-
-    async def _get_top_crypto_cryptocompare(self, limit: int) -> list:
-        """Используем CryptoCompare API"""
-        try:
-            url = "https://min-api.cryptocompare.com/data/top/mktcapfull"
-            params = {
-                'limit': limit,
-                'tsym': 'USD',
-                'api_key': self.cryptocompare_key
-            }
-
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, params=params, timeout=10) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        top_crypto = []
-
-                        for coin in data.get('Data', [])[:limit]:
-                            coin_info = coin.get('CoinInfo', {})
-                            raw = coin.get('RAW', {}).get('USD', {})
-                            display = coin.get('DISPLAY', {}).get('USD', {})
-
-                            top_crypto.append({
-                                'symbol': coin_info.get('Name', ''),
-                                'name': coin_info.get('FullName', ''),
-                                'price': raw.get('PRICE', 0),
-                                'change': raw.get('CHANGEPCT24HOUR', 0),
-                                'market_cap': raw.get('MKTCAP', 0)
-                            })
-
-                        return top_crypto
-            return []
-
-        except Exception as e:
-            print(f"Ошибка CryptoCompare: {e}")
-            return []
-
-    async def _get_top_crypto_coingecko(self, limit: int) -> list:
-        """CoinGecko с полной защитой от False/null и правильными % за 24ч"""
-        try:
-            url = "https://api.coingecko.com/api/v3/coins/markets"
-            # Проверяем и конвертируем '24h' в строку (никогда не False)
-            percentage_param = '24h'
-            if not isinstance(percentage_param, str):
-                percentage_param = '24h'  # fallback на строку
-
-            params = {
-                'vs_currency': 'usd',
-                'order': 'market_cap_desc',
-                'per_page': str(limit),  # int → str для безопасности
-                'page': '1',
-                'sparkline': 'false',  # bool → str
-                'price_change_percentage': percentage_param  # всегда str
-            }
-
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, params=params, timeout=15) as response:
-                    if response.status != 200:
-                        print(f"CoinGecko HTTP: {response.status} - {await response.text()}")
-                        return []
-
-                    data = await response.json()
-                    if not isinstance(data, list) or not data:
-                        print("CoinGecko: пустой ответ")
-                        return []
-
-                    top_crypto = []
-                    for coin in data[:limit]:
-                        # Безопасная обработка change (поле 'price_change_percentage_24h')
-                        change_raw = coin.get('price_change_percentage_24h')
-                        if change_raw is None or change_raw is False:
-                            change_24h = 0.0
-                        else:
-                            try:
-                                change_24h = float(change_raw)
-                            except (ValueError, TypeError):
-                                change_24h = 0.0
-
-                        # Безопасная цена
-                        price_raw = coin.get('current_price')
-                        price = float(price_raw) if price_raw and price_raw != 0 else 0.0
-
-                        top_crypto.append({
-                            'symbol': str(coin.get('symbol', '')).upper(),
-                            'name': str(coin.get('name', '')),
-                            'price': price,
-                            'change': round(change_24h, 2),
-                            'market_cap': float(coin.get('market_cap', 0)) if coin.get('market_cap') else 0
-                        })
-
-                    print(f"✅ CoinGecko: успешно получено {len(top_crypto)} монет")  # debug
-                    return top_crypto
-
-        except Exception as e:
-            print(f"Полная ошибка CoinGecko: {type(e).__name__}: {e}")
-            return []
+        """Актуальный топ по капитализации: CoinMarketCap / CryptoCompare / CoinGecko — кто ответит"""
+        top_crypto = await self.top_providers.fetch('fetch_top', limit)
+        if top_crypto:
+            print(f"✅ {self.top_providers.last_provider}: получено {len(top_crypto)} монет")
+            self.top_crypto = top_crypto
+            self.top_crypto_fetched_at = time.time()
+            return top_crypto
 
+        # Последний известный топ (в том числе с диска) лучше мок-данных
+        return self.top_crypto[:limit] or self._get_mock_crypto_data()
 
     def _get_mock_crypto_data(self) -> list:
         """Мок-данные только если все API упали"""
@@ -302,11 +585,29 @@ class CurrencyConverter:
         """
         base_currency = base_currency.upper()
 
+        # Обычно вся таблица уже есть в матрице — пересчитываем локально
+        matrix = await self.get_rate_matrix()
+        if matrix and base_currency in matrix:
+            return matrix.rates_from(base_currency, matrix.fiat_codes + (base_currency,))
+
+        ttl = self.rate_cache.crypto_ttl if self._is_crypto(base_currency) else self.rate_cache.fiat_ttl
+
+        rates = await self.rate_cache.get_or_fetch(
+            ('all', base_currency),
+            ttl,
+            lambda: self._fetch_all_rates(base_currency)
+        )
+        # Копия, чтобы хендлеры не испортили закэшированную таблицу
+        return dict(rates) if rates else {}
+
+    async def _fetch_all_rates(self, base_currency: str) -> Dict[str, float]:
+        """Загрузить таблицу курсов от base_currency из API (без кэша)"""
         # Если это криптовалюта — делаем через USD как промежуточную
         if self._is_crypto(base_currency):
             try:
                 # 1. Получаем курс 1 base_crypto → USD
-                crypto_to_usd = await self._get_crypto_rate_cryptocompare(base_currency, "USD")
+                quotes = await self.get_crypto_quotes([base_currency], ["USD"])
+                crypto_to_usd = quotes.get(base_currency, {}).get("USD")
                 if not crypto_to_usd or crypto_to_usd <= 0:
                     print(f"Не удалось получить курс {base_currency} → USD")
                     return {}
@@ -330,34 +631,28 @@ class CurrencyConverter:
                 print(f"Ошибка при пересчёте от {base_currency}: {e}")
                 return {}
 
-        # Если это фиат — используем стандартный API
+        # Если это фиат — спрашиваем фиатные источники (ExchangeRate-API, запасной open.er-api)
         else:
-            try:
-                if not self.base_url:
-                    return {}
-
-                url = f"{self.base_url}latest/{base_currency}"
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(url, timeout=15) as response:
-                        if response.status != 200:
-                            return {}
-                        data = await response.json()
-
-                        if data.get('result') == 'success':
-                            rates = data.get('conversion_rates', {})
-                            rates[base_currency] = 1.0  # на всякий случай
-                            return rates
-                        else:
-                            print(f"ExchangeRate API ошибка: {data.get('error-type')}")
-                            return {}
-
-            except Exception as e:
-                print(f"Ошибка get_all_rates({base_currency}): {e}")
+            rates = await self.fiat_providers.fetch('fetch_fiat_table', base_currency)
+            if not rates:
                 return {}
+            rates[base_currency] = 1.0  # на всякий случай
+            return rates
+
+    async def convert(self, amount: float, base_currency: str, target_currency: str) -> Optional[ConversionResult]:
+        """Конвертировать сумму из одной валюты в другую (один запрос курса на всю операцию)"""
+        quote = await self._lookup_rate(base_currency, target_currency)
+        if not quote:
+            return None
 
-    async def convert(self, amount: float, base_currency: str, target_currency: str) -> Optional[float]:
-        """Конвертировать сумму из одной валюты в другую"""
-        rate = await self.get_exchange_rate(base_currency, target_currency)
-        if rate:
-            return amount * rate
-        return None
\ No newline at end of file
+        rate, source, timestamp = quote
+        return ConversionResult(
+            amount=amount,
+            base_currency=base_currency.upper(),
+            target_currency=target_currency.upper(),
+            result=amount * rate,
+            rate=rate,
+            inverse=1 / rate,
+            source=source,
+            timestamp=timestamp
+        )
\ No newline at end of file
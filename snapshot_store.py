@@ -0,0 +1,76 @@
+# snapshot_store.py
+import json
+import os
+import sqlite3
+from array import array
+from typing import Any, Dict, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+class SnapshotStore:
+    """
+    Последний снимок курсов на диске (SQLite), чтобы после рестарта бот сразу отвечал.
+    Таблица курсов хранится как сырой array('d') — это пара килобайт на весь снимок.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.getenv('RATE_SNAPSHOT_PATH', 'rates_snapshot.sqlite3')
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS snapshot ("
+            "name TEXT PRIMARY KEY, meta TEXT, payload BLOB, fetched_at REAL)"
+        )
+        return conn
+
+    def save(self, matrix=None, top_crypto: Optional[list] = None, top_fetched_at: Optional[float] = None):
+        """Сохраняет то, что передано; остальные части снимка остаются прежними"""
+        rows = []
+        if matrix is not None:
+            meta = {
+                'codes': list(matrix.codes),
+                'fiat_codes': list(matrix.fiat_codes),
+                'crypto_codes': list(matrix.crypto_codes),
+            }
+            rows.append(('matrix', json.dumps(meta), matrix.values.tobytes(), matrix.fetched_at))
+        if top_crypto:
+            # Записи топа (payloads.CoinQuote) сериализуются как обычные словари
+            payload = json.dumps(top_crypto, default=lambda record: record.as_dict())
+            rows.append(('top_crypto', None, payload.encode('utf-8'), top_fetched_at))
+
+        if not rows:
+            return
+
+        conn = self._connect()
+        try:
+            with conn:
+                conn.executemany("INSERT OR REPLACE INTO snapshot VALUES (?, ?, ?, ?)", rows)
+        finally:
+            conn.close()
+
+    def load(self) -> Dict[str, Any]:
+        """
+        Возвращает {'matrix': {...}, 'top_crypto': (fetched_at, [...])}
+        только с теми частями, что есть в файле
+        """
+        if not os.path.exists(self.path):
+            return {}
+
+        conn = self._connect()
+        try:
+            rows = conn.execute("SELECT name, meta, payload, fetched_at FROM snapshot").fetchall()
+        finally:
+            conn.close()
+
+        result = {}
+        for name, meta, payload, fetched_at in rows:
+            if name == 'matrix':
+                values = array('d')
+                values.frombytes(payload)
+                result['matrix'] = dict(json.loads(meta), values=values, fetched_at=fetched_at)
+            elif name == 'top_crypto':
+                result[name] = (fetched_at, json.loads(payload.decode('utf-8')))
+        return result
@@ -0,0 +1,277 @@
+# storage.py
+import asyncio
+import json
+import os
+import sqlite3
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Mapping, Optional, Tuple
+from dotenv import load_dotenv
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from user_store import MemoryBackingStore, ProfileChanges, apply_changes
+
+load_dotenv()
+
+
+class SqliteDatabase:
+    """Одно соединение SQLite на процесс; все запросы идут в отдельном потоке и по очереди"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS fsm (key TEXT PRIMARY KEY, state TEXT, data TEXT)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS user_profiles (user_id INTEGER PRIMARY KEY, payload BLOB)"
+        )
+        self._conn.commit()
+        self._lock = asyncio.Lock()
+
+    async def run(self, fn: Callable[[sqlite3.Connection], Any]) -> Any:
+        async with self._lock:
+            return await asyncio.to_thread(fn, self._conn)
+
+    async def close(self):
+        async with self._lock:
+            await asyncio.to_thread(self._conn.close)
+
+
+class SqliteStorage(BaseStorage):
+    """
+    FSM-хранилище aiogram поверх SQLite с отложенной пакетной записью (write-behind):
+    хендлер меняет состояние в памяти, а на диск изменения уходят пачкой раз в STORAGE_FLUSH_INTERVAL.
+    В памяти — не больше STORAGE_CACHE_SIZE последних записей (LRU); пользователи без состояния
+    не кэшируются вовсе, хотя get_state вызывается на каждый апдейт.
+    """
+
+    def __init__(self, db: SqliteDatabase):
+        self.db = db
+        self.key_builder = DefaultKeyBuilder(with_destiny=True)
+        self.flush_interval = float(os.getenv('STORAGE_FLUSH_INTERVAL', '0.5'))
+        self.cache_size = int(os.getenv('STORAGE_CACHE_SIZE', '10000'))
+
+        # key -> [state, data]; только непустые записи и ещё не записанные изменения
+        self._cache: "OrderedDict[str, list]" = OrderedDict()
+        self._dirty: set = set()
+        self._flush_task: Optional[asyncio.Task] = None
+
+    async def _load(self, key: StorageKey, create: bool = False) -> list:
+        """Запись [state, data]; промах кэшируется, только если её сейчас будут менять (create)"""
+        str_key = self.key_builder.build(key)
+        record = self._cache.get(str_key)
+        if record is not None:
+            self._cache.move_to_end(str_key)
+            return record
+
+        row = await self.db.run(
+            lambda conn: conn.execute("SELECT state, data FROM fsm WHERE key = ?", (str_key,)).fetchone()
+        )
+        # Пока ждали диск, запись могли создать параллельно
+        record = self._cache.get(str_key)
+        if record is not None:
+            return record
+        if row is None and not create:
+            return [None, {}]
+
+        record = self._cache[str_key] = [row[0], json.loads(row[1])] if row else [None, {}]
+        if not create:
+            # Новую запись сейчас пометят изменённой — место под неё освобождает _mark_dirty
+            self._trim()
+        return record
+
+    def _trim(self):
+        """Вытесняет самые давние записи сверх STORAGE_CACHE_SIZE; незаписанные изменения не трогает"""
+        excess = len(self._cache) - self.cache_size
+        if excess <= 0:
+            return
+        for str_key in list(self._cache):
+            if excess <= 0:
+                break
+            if str_key not in self._dirty:
+                del self._cache[str_key]
+                excess -= 1
+
+    def _mark_dirty(self, key: StorageKey):
+        self._dirty.add(self.key_builder.build(key))
+        self._trim()
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def set_state(self, key: StorageKey, state=None) -> None:
+        record = await self._load(key, create=True)
+        record[0] = state.state if isinstance(state, State) else state
+        self._mark_dirty(key)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._load(key))[0]
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        record = await self._load(key, create=True)
+        record[1] = dict(data)
+        self._mark_dirty(key)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return dict((await self._load(key))[1])
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        await self.flush()
+
+    async def flush(self):
+        """Пишет все накопленные изменения одной транзакцией"""
+        if not self._dirty:
+            return
+
+        dirty, self._dirty = self._dirty, set()
+        upserts = []
+        deletes = []
+        for str_key in dirty:
+            state, data = self._cache[str_key]
+            if state is None and not data:
+                # Пустые записи (после state.clear()) не храним ни на диске, ни в памяти
+                deletes.append((str_key,))
+                self._cache.pop(str_key, None)
+            else:
+                upserts.append((str_key, state, json.dumps(data, ensure_ascii=False)))
+
+        def write(conn: sqlite3.Connection):
+            with conn:
+                conn.executemany("INSERT OR REPLACE INTO fsm VALUES (?, ?, ?)", upserts)
+                conn.executemany("DELETE FROM fsm WHERE key = ?", deletes)
+
+        try:
+            await self.db.run(write)
+        except Exception as e:
+            print(f"Ошибка записи FSM в SQLite: {e}")
+            self._dirty |= dirty - {key for key, in deletes}
+            return
+        self._trim()
+
+    async def close(self) -> None:
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+        await self.flush()
+
+
+class SqliteBackingStore:
+    """Профили пользователей (UserStore) в той же базе SQLite"""
+
+    persistent = True
+
+    def __init__(self, db: SqliteDatabase):
+        self.db = db
+
+    async def load(self, user_id: int) -> Optional[bytes]:
+        row = await self.db.run(
+            lambda conn: conn.execute(
+                "SELECT payload FROM user_profiles WHERE user_id = ?", (user_id,)
+            ).fetchone()
+        )
+        return row[0] if row else None
+
+    async def apply_many(self, changes: Dict[int, ProfileChanges], history_limit: int, messages_limit: int):
+        """Чтение и запись каждой записи — в одной транзакции, так что изменения накладываются на актуальные данные"""
+        def write(conn: sqlite3.Connection):
+            with conn:
+                for user_id, user_changes in changes.items():
+                    row = conn.execute("SELECT payload FROM user_profiles WHERE user_id = ?", (user_id,)).fetchone()
+                    payload = apply_changes(row[0] if row else None, user_changes, history_limit, messages_limit)
+                    conn.execute("INSERT OR REPLACE INTO user_profiles VALUES (?, ?)", (user_id, payload))
+
+        await self.db.run(write)
+
+    async def count(self) -> int:
+        row = await self.db.run(lambda conn: conn.execute("SELECT COUNT(*) FROM user_profiles").fetchone())
+        return row[0]
+
+    async def close(self):
+        await self.db.close()
+
+
+class RedisBackingStore:
+    """
+    Профили пользователей в Redis (или любом сервере с протоколом Redis) — общие для нескольких процессов.
+    Поля хранятся отдельно (основная валюта — строка, история и id сообщений — списки),
+    изменения накладываются атомарными командами, а не перезаписью всей записи
+    """
+
+    persistent = True
+
+    def __init__(self, redis, prefix: str = 'user_profile'):
+        self.redis = redis
+        self.prefix = prefix
+        self.ids_key = f'{prefix}:ids'
+
+    def _keys(self, user_id: int) -> Tuple[str, str, str]:
+        key = f'{self.prefix}:{user_id}'
+        return f'{key}:base', f'{key}:history', f'{key}:messages'
+
+    async def load(self, user_id: int) -> Optional[bytes]:
+        base_key, history_key, messages_key = self._keys(user_id)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.get(base_key)
+            pipe.lrange(history_key, 0, -1)
+            pipe.lrange(messages_key, 0, -1)
+            base, history, message_ids = await pipe.execute()
+        if base is None and not history and not message_ids:
+            return None
+        # Тот же формат, что у UserState.dump()
+        return json.dumps([
+            base.decode('utf-8') if base is not None else None,
+            [json.loads(entry) for entry in history],
+            [int(message_id) for message_id in message_ids],
+        ]).encode('utf-8')
+
+    async def apply_many(self, changes: Dict[int, ProfileChanges], history_limit: int, messages_limit: int):
+        async with self.redis.pipeline(transaction=True) as pipe:
+            for user_id, user_changes in changes.items():
+                base_key, history_key, messages_key = self._keys(user_id)
+                pipe.sadd(self.ids_key, user_id)
+                if user_changes.base_currency is not None:
+                    pipe.set(base_key, user_changes.base_currency)
+                if user_changes.history_cleared:
+                    pipe.delete(history_key)
+                if user_changes.history:
+                    pipe.rpush(history_key, *(json.dumps(list(entry)) for entry in user_changes.history))
+                    pipe.ltrim(history_key, -history_limit, -1)
+                for message_id in user_changes.messages_removed:
+                    pipe.lrem(messages_key, 0, message_id)
+                if user_changes.messages_added:
+                    pipe.rpush(messages_key, *user_changes.messages_added)
+                    pipe.ltrim(messages_key, -messages_limit, -1)
+            await pipe.execute()
+
+    async def count(self) -> int:
+        return await self.redis.scard(self.ids_key)
+
+    async def close(self):
+        await self.redis.aclose()
+
+
+def create_storage() -> Tuple[BaseStorage, Any]:
+    """
+    FSM-хранилище и backing store профилей по STORAGE_BACKEND:
+    memory (по умолчанию), sqlite (один процесс) или redis (несколько процессов)
+    """
+    backend = os.getenv('STORAGE_BACKEND', 'memory').lower()
+
+    if backend == 'sqlite':
+        db = SqliteDatabase(os.getenv('STORAGE_SQLITE_PATH', 'bot_storage.sqlite3'))
+        return SqliteStorage(db), SqliteBackingStore(db)
+
+    if backend == 'redis':
+        # redis — необязательная зависимость, нужна только для этого режима
+        from redis.asyncio import Redis
+        from aiogram.fsm.storage.redis import RedisStorage
+
+        url = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+        storage = RedisStorage.from_url(url, key_builder=DefaultKeyBuilder(with_destiny=True))
+        return storage, RedisBackingStore(Redis.from_url(url))
+
+    return MemoryStorage(), MemoryBackingStore()
@@ -0,0 +1,89 @@
+# test_convert_latency.py
+"""
+Латентность /convert: N одновременных конвертаций на холодном кэше стоят примерно одного
+похода в API, а не N — запросы к источникам асинхронные и схлопываются в один.
+"""
+import asyncio
+import time
+
+# Первым: там же задаются переменные окружения, без которых main не импортируется
+from test_rates_screens import FakeMessage, StubConverter
+
+import main
+
+# Задержка одного запроса к API в заглушке
+ROUND_TRIP = 0.2
+CONCURRENT = 20
+PAIRS = [('USD', 'EUR'), ('RUB', 'GBP'), ('EUR', 'JPY'), ('CNY', 'TRY'), ('KZT', 'UAH'), ('BTC', 'RUB')]
+
+
+class SlowConverter(StubConverter):
+    """StubConverter, у которого каждый запрос к API занимает ROUND_TRIP и не держит event loop"""
+
+    async def _fetch_all_rates(self, base_currency: str):
+        await asyncio.sleep(ROUND_TRIP)
+        return await super()._fetch_all_rates(base_currency)
+
+    async def _fetch_crypto_quotes(self, symbols, targets):
+        await asyncio.sleep(ROUND_TRIP)
+        return await super()._fetch_crypto_quotes(symbols, targets)
+
+
+class CommandMessage(FakeMessage):
+    def __init__(self, text: str, user_id: int = 1):
+        super().__init__(user_id)
+        self.text = text
+
+
+def convert_messages(count: int) -> list:
+    messages = []
+    for i in range(count):
+        base, target = PAIRS[i % len(PAIRS)]
+        messages.append(CommandMessage(f"/convert {i + 1} {base} {target}", user_id=i + 1))
+    return messages
+
+
+async def watch_loop(stalls: list):
+    """Тикает каждые 10 ms и записывает, насколько event loop опоздал с тиком"""
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(0.01)
+        stalls.append(time.perf_counter() - started - 0.01)
+
+
+async def timed_converts(count: int):
+    """(время на все конвертации, самая долгая остановка event loop за это время)"""
+    messages = convert_messages(count)
+    stalls = [0.0]
+    watcher = asyncio.create_task(watch_loop(stalls))
+    await asyncio.sleep(0)
+    started = time.perf_counter()
+    await asyncio.gather(*(main.cmd_convert(message) for message in messages))
+    elapsed = time.perf_counter() - started
+    watcher.cancel()
+    for message in messages:
+        assert message.texts and 'Результат конвертации' in message.texts[-1], message.texts
+    return elapsed, max(stalls)
+
+
+def test_concurrent_converts_take_about_one_round_trip(monkeypatch):
+    async def scenario():
+        single_converter = SlowConverter()
+        monkeypatch.setattr(main, 'converter', single_converter)
+        single, _ = await timed_converts(1)
+
+        concurrent_converter = SlowConverter()
+        monkeypatch.setattr(main, 'converter', concurrent_converter)
+        concurrent, stall = await timed_converts(CONCURRENT)
+
+        print(f"\n/convert: 1 запрос {single * 1000:.0f} ms, {CONCURRENT} одновременных {concurrent * 1000:.0f} ms")
+        # Одна таблица курсов на всех, а не своя на каждый запрос
+        assert concurrent_converter.fiat_calls == 1
+        assert concurrent_converter.crypto_calls == 1
+        # Примерно как один запрос и несравнимо меньше, чем N запросов подряд
+        assert concurrent < single * 1.5
+        assert concurrent < single * CONCURRENT / 4
+        # Пока ждём API, остальные апдейты обслуживаются: event loop не блокируется
+        assert stall < ROUND_TRIP / 2
+
+    asyncio.run(scenario())
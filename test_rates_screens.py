@@ -0,0 +1,136 @@
+# test_rates_screens.py
+"""
+Регрессия: экраны "Курсы валют" и "Топ курсов" собираются из одного снимка курсов.
+Первый показ стоит не больше одного запроса фиатной таблицы и одного пакета котировок крипты,
+повторный (пока снимок в кэше) — ни одного.
+"""
+import asyncio
+import os
+from types import SimpleNamespace
+
+import pytest
+
+os.environ.setdefault('BOT_TOKEN', '123456:TEST')
+os.environ['RATE_SNAPSHOT_PATH'] = os.devnull
+
+import main
+from render_cache import RenderCache
+from services import CurrencyConverter
+from user_store import UserStore
+
+USD_RATES = {'RUB': 90.0, 'EUR': 0.92, 'GBP': 0.79, 'JPY': 150.0, 'CNY': 7.2, 'CHF': 0.88,
+             'CAD': 1.36, 'TRY': 32.0, 'KZT': 450.0, 'UAH': 39.0, 'BYN': 3.27, 'AED': 3.67}
+
+# Не больше стольких обращений к API на один показ экрана
+MAX_FIAT_CALLS_PER_RENDER = 1
+MAX_CRYPTO_CALLS_PER_RENDER = 1
+
+
+class StubConverter(CurrencyConverter):
+    """CurrencyConverter без сети: считает обращения к API и отвечает фиксированными данными"""
+
+    def __init__(self):
+        super().__init__()
+        self.fiat_calls = 0
+        self.crypto_calls = 0
+        self.pair_calls = 0
+
+    async def _fetch_all_rates(self, base_currency: str):
+        self.fiat_calls += 1
+        assert base_currency == 'USD', "фиатная таблица должна запрашиваться один раз, от USD"
+        return dict(USD_RATES)
+
+    async def _fetch_crypto_quotes(self, symbols, targets):
+        self.crypto_calls += 1
+        return {'BTC': {'USD': 60000.0}, 'ETH': {'USD': 3000.0}}
+
+    async def get_exchange_rate(self, base_currency: str, target_currency: str):
+        # Поштучные курсы на каждую строку экрана — как раз то, от чего ушли
+        self.pair_calls += 1
+        return await super().get_exchange_rate(base_currency, target_currency)
+
+    def reset_counters(self):
+        self.fiat_calls = self.crypto_calls = self.pair_calls = 0
+
+
+class FakeMessage:
+    def __init__(self, user_id: int = 1):
+        self.from_user = SimpleNamespace(id=user_id)
+        self.texts = []
+
+    async def delete(self):
+        pass
+
+    async def answer(self, text, **kwargs):
+        self.texts.append(text)
+        return self
+
+    async def edit_text(self, text, **kwargs):
+        self.texts.append(text)
+        return self
+
+
+@pytest.fixture
+def converter(monkeypatch):
+    converter = StubConverter()
+    sent = []
+
+    async def fake_send_photo(message, photo_key, caption="", **kwargs):
+        sent.append(caption)
+        return True, None
+
+    async def fake_delete_previous_messages(*args, **kwargs):
+        pass
+
+    monkeypatch.setattr(main, 'converter', converter)
+    monkeypatch.setattr(main, 'render_cache', RenderCache())
+    monkeypatch.setattr(main, 'user_store', UserStore())
+    monkeypatch.setattr(main, 'send_photo', fake_send_photo)
+    monkeypatch.setattr(main, 'delete_previous_messages', fake_delete_previous_messages)
+    converter.sent = sent
+    return converter
+
+
+def assert_bounded(converter):
+    assert converter.fiat_calls <= MAX_FIAT_CALLS_PER_RENDER
+    assert converter.crypto_calls <= MAX_CRYPTO_CALLS_PER_RENDER
+    assert converter.pair_calls == 0
+
+
+def test_show_rates_renders_from_one_snapshot(converter):
+    async def scenario():
+        await main.show_rates(FakeMessage(), None)
+        assert_bounded(converter)
+        assert converter.sent and '90' in converter.sent[-1]
+
+        converter.reset_counters()
+        await main.show_rates(FakeMessage(), None)
+        assert (converter.fiat_calls, converter.crypto_calls, converter.pair_calls) == (0, 0, 0)
+
+    asyncio.run(scenario())
+
+
+def test_show_top_rates_renders_from_one_snapshot(converter):
+    async def scenario():
+        message = FakeMessage()
+        await main.show_top_rates(message)
+        assert_bounded(converter)
+        assert 'Ошибка' not in message.texts[-1]
+
+        converter.reset_counters()
+        await main.show_top_rates(FakeMessage())
+        assert (converter.fiat_calls, converter.crypto_calls, converter.pair_calls) == (0, 0, 0)
+
+    asyncio.run(scenario())
+
+
+def test_published_snapshot_needs_no_upstream_calls(converter):
+    async def scenario():
+        converter.publish_snapshot(await converter._build_rate_matrix())
+        converter.reset_counters()
+
+        await main.show_rates(FakeMessage(), None)
+        await main.show_top_rates(FakeMessage())
+        assert (converter.fiat_calls, converter.crypto_calls, converter.pair_calls) == (0, 0, 0)
+
+    asyncio.run(scenario())
@@ -0,0 +1,94 @@
+# test_render_cache.py
+"""
+Регрессия: повторный показ тяжёлого экрана с той же версией данных ничего не форматирует заново,
+а новая версия снимка (курсов или доски рынка) сбрасывает готовый текст.
+"""
+import asyncio
+import time
+from types import SimpleNamespace
+
+# Первым: там же задаются переменные окружения, без которых main не импортируется
+from test_rates_screens import FakeMessage, converter  # noqa: F401 — фикстура converter
+
+import main
+from market_board import Board
+from payloads import CoinQuote
+from render_cache import RenderCache
+
+
+class CountingRender:
+    """Обёртка над функцией отрисовки экрана: считает реальные вызовы"""
+
+    def __init__(self, render):
+        self.render = render
+        self.calls = 0
+
+    def __call__(self, *args, **kwargs):
+        self.calls += 1
+        return self.render(*args, **kwargs)
+
+
+class FakeCallback:
+    def __init__(self, user_id: int = 1):
+        self.from_user = SimpleNamespace(id=user_id)
+        self.message = FakeMessage(user_id)
+
+    async def answer(self, *args, **kwargs):
+        pass
+
+
+def make_board(price: float) -> Board:
+    coins = [CoinQuote('BTC', 'Bitcoin', price, 1.5, 1.2e12), CoinQuote('ETH', 'Ethereum', 3000.0, -0.5, 3.6e11)]
+    return Board(tuple(coins), 'CoinGecko', time.time())
+
+
+def test_same_version_is_rendered_once():
+    cache = RenderCache()
+    render = CountingRender(lambda: "text")
+
+    assert cache.get_or_render("screen", 1, "RUB", render) == "text"
+    assert cache.get_or_render("screen", 1, "RUB", render) == "text"
+    assert render.calls == 1
+
+    cache.get_or_render("screen", 2, "RUB", render)
+    assert render.calls == 2
+    # Старая версия выброшена целиком, а не лежит рядом с новой
+    assert len(cache) == 1
+
+
+def test_show_rates_reuses_render_until_snapshot_changes(converter, monkeypatch):
+    render = CountingRender(main.render_rates)
+    monkeypatch.setattr(main, 'render_rates', render)
+
+    async def scenario():
+        converter.publish_snapshot(await converter._build_rate_matrix())
+        for _ in range(3):
+            await main.show_rates(FakeMessage(), None)
+        assert render.calls == 1
+
+        # Новый снимок — новая версия: экран отрисовывается заново, уже с новыми курсами
+        converter.publish_snapshot(await converter._build_rate_matrix())
+        await main.show_rates(FakeMessage(), None)
+        await main.show_rates(FakeMessage(), None)
+        assert render.calls == 2
+
+    asyncio.run(scenario())
+
+
+def test_show_top_crypto_reuses_render_until_board_changes(converter, monkeypatch):
+    render = CountingRender(main.render_top_crypto)
+    monkeypatch.setattr(main, 'render_top_crypto', render)
+    monkeypatch.setattr(main.market_board, 'board', make_board(60000.0))
+
+    async def scenario():
+        for _ in range(3):
+            await main.show_top_crypto(FakeCallback())
+        assert render.calls == 1
+
+        main.market_board.board = make_board(61000.0)
+        await main.show_top_crypto(FakeCallback())
+        await main.show_top_crypto(FakeCallback())
+        assert render.calls == 2
+        assert '61,000' in converter.sent[-1]
+
+    asyncio.run(scenario())
@@ -0,0 +1,100 @@
+# update_limiter.py
+import asyncio
+import os
+from typing import Any, Awaitable, Callable, Dict, Set, Tuple
+from dotenv import load_dotenv
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+load_dotenv()
+
+
+class _UserSlot:
+    """Очередь апдейтов одного пользователя: lock плюс счётчик ждущих, чтобы вовремя выбросить слот"""
+
+    __slots__ = ('lock', 'users')
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.users = 0
+
+
+class UpdateLimiterMiddleware(BaseMiddleware):
+    """
+    Outer-middleware на апдейты:
+    - апдейты одного пользователя обрабатываются строго по очереди (в пределах процесса);
+    - в очереди одного пользователя не больше MAX_QUEUED_UPDATES_PER_USER апдейтов, лишние отбрасываются;
+    - одновременно работает не больше MAX_INFLIGHT_HANDLERS хендлеров на весь бот;
+    - повторный callback с той же data, пока предыдущий ещё ждёт или выполняется, отбрасывается.
+    Каждый апдейт должен идти в своей задаче (polling с handle_as_tasks, WebhookServer):
+    ожидание очереди пользователя — это просто спящая задача, общих воркеров она не держит.
+    """
+
+    def __init__(self):
+        self.max_inflight = int(os.getenv('MAX_INFLIGHT_HANDLERS', '64'))
+        self.max_queued_per_user = int(os.getenv('MAX_QUEUED_UPDATES_PER_USER', '10'))
+        self._semaphore = asyncio.Semaphore(self.max_inflight)
+        self._users: Dict[int, _UserSlot] = {}
+        self._pending_callbacks: Set[Tuple[int, str]] = set()
+        self.dropped_callbacks = 0
+        self.dropped_updates = 0
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get('event_from_user')
+        if user is None:
+            async with self._semaphore:
+                return await handler(event, data)
+
+        slot = self._users.get(user.id)
+        callback = event.callback_query
+        if slot is not None and slot.users >= self.max_queued_per_user:
+            # Пользователь шлёт быстрее, чем мы отвечаем, — дальше копить его апдейты незачем
+            self.dropped_updates += 1
+            if callback is not None:
+                try:
+                    await callback.answer()
+                except Exception:
+                    pass
+            return None
+
+        callback_key = None
+        if callback is not None and callback.data:
+            callback_key = (user.id, callback.data)
+            if callback_key in self._pending_callbacks:
+                # Такое же нажатие уже в работе — его результат увидит и этот клик
+                self.dropped_callbacks += 1
+                try:
+                    await callback.answer()
+                except Exception:
+                    pass
+                return None
+            self._pending_callbacks.add(callback_key)
+
+        if slot is None:
+            slot = self._users[user.id] = _UserSlot()
+        slot.users += 1
+        try:
+            async with slot.lock:
+                async with self._semaphore:
+                    return await handler(event, data)
+        finally:
+            slot.users -= 1
+            if not slot.users:
+                del self._users[user.id]
+            if callback_key is not None:
+                self._pending_callbacks.discard(callback_key)
+
+    def stats(self) -> dict:
+        return {
+            'inflight': self.max_inflight - self._semaphore._value,
+            'users_queued': len(self._users),
+            'callbacks_pending': len(self._pending_callbacks),
+            'callbacks_dropped': self.dropped_callbacks,
+            'updates_dropped': self.dropped_updates,
+        }
@@ -0,0 +1,346 @@
+# user_store.py
+import asyncio
+import json
+import os
+import sys
+import time
+from collections import OrderedDict, deque, namedtuple
+from typing import Dict, Iterable, List, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Одна запись истории конвертаций (кортеж — заметно компактнее dict)
+HistoryEntry = namedtuple('HistoryEntry', ['date', 'from_', 'to', 'rate'])
+
+
+class UserState:
+    """Данные одного пользователя: основная валюта, история конвертаций и id сообщений бота"""
+
+    __slots__ = ('user_id', 'base_currency', 'conversion_history', 'message_ids', 'last_seen')
+
+    def __init__(self, user_id: int, base_currency: str, history_limit: int, messages_limit: int):
+        self.user_id = user_id
+        self.base_currency = base_currency
+        # Кольцевые буферы: старые записи вытесняются сами
+        self.conversion_history = deque(maxlen=history_limit)
+        self.message_ids = deque(maxlen=messages_limit)
+        self.last_seen = time.monotonic()
+
+    def add_history(self, date: str, from_: str, to: str, rate: float):
+        self.conversion_history.append(HistoryEntry(date, from_, to, rate))
+
+    def dump(self) -> bytes:
+        return json.dumps([
+            self.base_currency,
+            [list(entry) for entry in self.conversion_history],
+            list(self.message_ids),
+        ], separators=(',', ':')).encode('utf-8')
+
+    def load(self, raw: bytes):
+        """Заменяет данные записи сохранёнными (запись может быть уже заполнена — при перечитывании)"""
+        base_currency, history, message_ids = json.loads(raw)
+        # В записи, собранной из отдельных полей, основной валюты может ещё не быть
+        if base_currency:
+            self.base_currency = base_currency
+        self.conversion_history.clear()
+        self.message_ids.clear()
+        self.conversion_history.extend(HistoryEntry(*entry) for entry in history)
+        self.message_ids.extend(message_ids)
+
+    def approx_size(self) -> int:
+        """Примерный объём записи в памяти, байт"""
+        size = sys.getsizeof(self) + sys.getsizeof(self.conversion_history) + sys.getsizeof(self.message_ids)
+        size += sum(sys.getsizeof(entry) for entry in self.conversion_history)
+        size += 28 * len(self.message_ids)  # int в CPython
+        return size
+
+
+class MemoryBackingStore:
+    """Хранилище для вытесненных пользователей: сериализованные байты вместо живых объектов"""
+
+    # Живёт только в памяти процесса — изменения активных пользователей сбрасывать незачем
+    persistent = False
+
+    def __init__(self):
+        self._records: Dict[int, bytes] = {}
+
+    async def load(self, user_id: int) -> Optional[bytes]:
+        return self._records.pop(user_id, None)
+
+    async def save_many(self, records: Dict[int, bytes]):
+        self._records.update(records)
+
+    async def count(self) -> int:
+        return len(self._records)
+
+    def size_bytes(self) -> int:
+        return sum(len(raw) for raw in self._records.values())
+
+    async def close(self):
+        pass
+
+
+class ProfileChanges:
+    """
+    Изменения профиля, ещё не записанные в постоянный backing store.
+    Пишутся по полям (добавить/убрать id, дописать историю), а не целой записью, —
+    поэтому процессы, обслуживающие одного пользователя, не затирают изменения друг друга
+    """
+
+    __slots__ = ('base_currency', 'history_cleared', 'history', 'messages_added', 'messages_removed')
+
+    def __init__(self):
+        self.base_currency: Optional[str] = None
+        self.history_cleared = False
+        self.history: List[HistoryEntry] = []
+        self.messages_added: List[int] = []
+        self.messages_removed: List[int] = []
+
+    def add_message(self, message_id: int):
+        self.messages_added.append(message_id)
+
+    def remove_message(self, message_id: int):
+        # Id, который ещё не успели записать, проще просто не записывать
+        if message_id in self.messages_added:
+            self.messages_added.remove(message_id)
+        else:
+            self.messages_removed.append(message_id)
+
+    def apply_to(self, state: UserState):
+        """Накладывает изменения на запись (например, только что перечитанную из хранилища)"""
+        if self.base_currency is not None:
+            state.base_currency = self.base_currency
+        if self.history_cleared:
+            state.conversion_history.clear()
+        state.conversion_history.extend(self.history)
+        for message_id in self.messages_removed:
+            if message_id in state.message_ids:
+                state.message_ids.remove(message_id)
+        state.message_ids.extend(message_id for message_id in self.messages_added
+                                 if message_id not in state.message_ids)
+
+
+class UserStore:
+    """
+    Ограниченное хранилище пользователей вместо глобальных user_data / user_messages.
+    В памяти держится не больше USER_STORE_MAX_ACTIVE записей; давно неактивные
+    пользователи (LRU) сериализуются в backing store и поднимаются обратно при обращении.
+
+    С постоянным backing store (SQLite, Redis) запись в памяти — только рабочая копия:
+    get() каждый раз перечитывает её из хранилища и накладывает свои незаписанные изменения.
+    Менять профиль нужно через методы стора: изменения пишутся по полям, а не целой записью
+    (иначе процессы затирали бы друг другу id сообщений), id сообщений и история — пакетом
+    раз в USER_STORE_FLUSH_INTERVAL, основная валюта — сразу.
+    """
+
+    def __init__(self, backing_store=None):
+        self.default_base_currency = os.getenv('DEFAULT_BASE_CURRENCY', 'RUB')
+        self.max_active = int(os.getenv('USER_STORE_MAX_ACTIVE', '10000'))
+        self.idle_ttl = float(os.getenv('USER_STORE_IDLE_TTL', '3600'))
+        self.history_limit = int(os.getenv('USER_HISTORY_LIMIT', '20'))
+        self.messages_limit = int(os.getenv('USER_MESSAGES_LIMIT', '50'))
+        self.flush_interval = float(os.getenv('USER_STORE_FLUSH_INTERVAL', '1'))
+
+        self.backing_store = backing_store if backing_store is not None else MemoryBackingStore()
+        self._active: "OrderedDict[int, UserState]" = OrderedDict()
+        # Незаписанные изменения по полям (только для постоянного backing store)
+        self._changes: Dict[int, ProfileChanges] = {}
+        # Вытесненные пользователи, уже сериализованные целиком (MemoryBackingStore), ещё не записанные
+        self._pending: Dict[int, bytes] = {}
+        # Изменения из батча, который пишется прямо сейчас: перечитывать этих пользователей ещё рано
+        self._writing: Dict[int, ProfileChanges] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def _new_state(self, user_id: int) -> UserState:
+        return UserState(user_id, self.default_base_currency, self.history_limit, self.messages_limit)
+
+    async def get(self, user_id: int) -> UserState:
+        """Запись пользователя (создаётся или поднимается из backing store при необходимости)"""
+        state = self._active.get(user_id)
+        if state is None:
+            raw = self._pending.pop(user_id, None)
+            if raw is None:
+                raw = await self.backing_store.load(user_id)
+            # Пока ждали backing store, запись могли поднять параллельно
+            state = self._active.get(user_id)
+            if state is None:
+                state = self._new_state(user_id)
+                self._reload(state, raw)
+                self._active[user_id] = state
+        else:
+            self._active.move_to_end(user_id)
+            if self.backing_store.persistent and user_id not in self._writing:
+                raw = await self.backing_store.load(user_id)
+                # Обновляем тот же объект: ссылки на него могут быть у других хендлеров
+                if user_id not in self._writing:
+                    self._reload(state, raw)
+
+        state.last_seen = time.monotonic()
+        self._evict()
+        return state
+
+    def _reload(self, state: UserState, raw: Optional[bytes]):
+        if raw is not None:
+            state.load(raw)
+        changes = self._changes.get(state.user_id)
+        if changes is not None:
+            changes.apply_to(state)
+
+    def _changes_for(self, user_id: int) -> Optional[ProfileChanges]:
+        """Журнал изменений пользователя; None — backing store не постоянный, писать нечего"""
+        if not self.backing_store.persistent:
+            return None
+        changes = self._changes.get(user_id)
+        if changes is None:
+            changes = self._changes[user_id] = ProfileChanges()
+        self._schedule_flush()
+        return changes
+
+    async def set_base_currency(self, user_id: int, currency: str) -> UserState:
+        """Меняет основную валюту и сразу пишет её в хранилище"""
+        state = await self.get(user_id)
+        state.base_currency = currency
+        changes = self._changes_for(user_id)
+        if changes is not None:
+            changes.base_currency = currency
+            await self.flush()
+        return state
+
+    async def add_history(self, user_id: int, date: str, from_: str, to: str, rate: float):
+        state = await self.get(user_id)
+        state.add_history(date, from_, to, rate)
+        changes = self._changes_for(user_id)
+        if changes is not None:
+            changes.history.append(state.conversion_history[-1])
+
+    async def add_message_id(self, user_id: int, message_id: int):
+        (await self.get(user_id)).message_ids.append(message_id)
+        changes = self._changes_for(user_id)
+        if changes is not None:
+            changes.add_message(message_id)
+
+    async def remove_message_ids(self, user_id: int, message_ids: Iterable[int]):
+        state = await self.get(user_id)
+        changes = self._changes_for(user_id)
+        for message_id in message_ids:
+            if message_id in state.message_ids:
+                state.message_ids.remove(message_id)
+            if changes is not None:
+                changes.remove_message(message_id)
+
+    async def take_message_ids(self, user_id: int, keep_last: int = 0) -> List[int]:
+        """Забирает из профиля все id сообщений, кроме keep_last последних"""
+        message_ids = (await self.get(user_id)).message_ids
+        taken = list(message_ids)[:max(len(message_ids) - keep_last, 0)]
+        if taken:
+            await self.remove_message_ids(user_id, taken)
+        return taken
+
+    async def reset(self, user_id: int) -> UserState:
+        """Сбрасывает настройки пользователя (например, по /start); id сообщений сохраняются"""
+        state = await self.get(user_id)
+        state.base_currency = self.default_base_currency
+        state.conversion_history.clear()
+        changes = self._changes_for(user_id)
+        if changes is not None:
+            changes.base_currency = self.default_base_currency
+            changes.history_cleared = True
+            changes.history.clear()
+            await self.flush()
+        return state
+
+    def _schedule_flush(self):
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        await self.flush()
+
+    async def flush(self):
+        """Пишет все накопленные изменения в backing store одним батчем"""
+        pending, self._pending = self._pending, {}
+        changes, self._changes = self._changes, {}
+        if pending:
+            try:
+                await self.backing_store.save_many(pending)
+            except Exception as e:
+                print(f"Ошибка записи профилей пользователей: {e}")
+                for user_id, raw in pending.items():
+                    self._pending.setdefault(user_id, raw)
+        if not changes:
+            return
+
+        self._writing.update(changes)
+        try:
+            await self.backing_store.apply_many(changes, self.history_limit, self.messages_limit)
+        except Exception as e:
+            print(f"Ошибка записи профилей пользователей: {e}")
+            # Не потеряем: изменения вернутся в очередь (раньше более новых) и уйдут со следующим батчем
+            for user_id, old in changes.items():
+                newer = self._changes.get(user_id)
+                if newer is not None:
+                    _merge_changes(old, newer)
+                self._changes[user_id] = old
+            self._schedule_flush()
+        finally:
+            for user_id in changes:
+                self._writing.pop(user_id, None)
+
+    def _evict(self):
+        now = time.monotonic()
+        evicted = False
+        while self._active:
+            user_id, state = next(iter(self._active.items()))
+            if len(self._active) <= self.max_active and now - state.last_seen < self.idle_ttl:
+                break
+            del self._active[user_id]
+            # Постоянному хранилищу хватает журнала изменений, целиком сериализуем только для памяти
+            if not self.backing_store.persistent:
+                self._pending[user_id] = state.dump()
+                evicted = True
+        if evicted:
+            self._schedule_flush()
+
+    async def close(self):
+        """Дописывает всё несохранённое и закрывает backing store"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+        await self.flush()
+        await self.backing_store.close()
+
+    async def stats(self) -> dict:
+        """Учёт памяти: сколько пользователей в памяти, сколько вытеснено и сколько это весит"""
+        stats = {
+            'active_users': len(self._active),
+            'active_bytes': sum(state.approx_size() for state in self._active.values()),
+            'pending_users': len(self._pending) + len(self._changes),
+            'stored_users': await self.backing_store.count(),
+        }
+        if hasattr(self.backing_store, 'size_bytes'):
+            stats['stored_bytes'] = self.backing_store.size_bytes()
+        return stats
+
+
+def _merge_changes(old: ProfileChanges, newer: ProfileChanges):
+    """Дописывает более новые изменения поверх старых (после неудачной записи)"""
+    if newer.base_currency is not None:
+        old.base_currency = newer.base_currency
+    if newer.history_cleared:
+        old.history_cleared = True
+        old.history = list(newer.history)
+    else:
+        old.history.extend(newer.history)
+    for message_id in newer.messages_removed:
+        old.remove_message(message_id)
+    old.messages_added.extend(newer.messages_added)
+
+
+def apply_changes(raw: Optional[bytes], changes: ProfileChanges, history_limit: int, messages_limit: int) -> bytes:
+    """Применяет изменения к сериализованной записи — для хранилищ без операций над полями (SQLite)"""
+    state = UserState(0, None, history_limit, messages_limit)
+    if raw is not None:
+        state.load(raw)
+    changes.apply_to(state)
+    return state.dump()
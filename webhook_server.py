@@ -0,0 +1,115 @@
+# webhook_server.py
+import asyncio
+import hmac
+import os
+from typing import Optional, Set
+from dotenv import load_dotenv
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+load_dotenv()
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+def webhook_processes() -> int:
+    """Сколько процессов бота принимают апдейты (WEBHOOK_PROCESSES в режиме webhook, иначе один)"""
+    if os.getenv('BOT_MODE', 'polling') != 'webhook':
+        return 1
+    return max(1, int(os.getenv('WEBHOOK_PROCESSES', '1')))
+
+
+class WebhookServer:
+    """
+    Приём апдейтов через webhook вместо long polling.
+    Запрос от Telegram только проверяется, и под апдейт запускается отдельная задача — ответ 200 уходит сразу.
+    Принятых, но ещё не обработанных апдейтов не больше WEBHOOK_QUEUE_SIZE (дальше — 503);
+    параллельность хендлеров и очередь апдейтов одного пользователя ограничивает UpdateLimiterMiddleware.
+    Отдельного пула воркеров нет: пользователь, ждущий своей очереди, не занимает воркер, нужный другим.
+    Сокет открывается с SO_REUSEPORT, поэтому несколько процессов могут слушать один порт.
+    """
+
+    def __init__(self, dp: Dispatcher, bot: Bot):
+        self.dp = dp
+        self.bot = bot
+        self.base_url = os.getenv('WEBHOOK_URL', '').rstrip('/')
+        self.path = os.getenv('WEBHOOK_PATH', '/webhook')
+        self.host = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+        self.port = int(os.getenv('WEBHOOK_PORT', '8080'))
+        self.secret = os.getenv('WEBHOOK_SECRET', '')
+        if not self.secret:
+            # Без секрета любой, кто знает адрес, может слать боту поддельные апдейты
+            raise RuntimeError("WEBHOOK_SECRET обязателен в режиме webhook")
+        # Сколько соединений Telegram может держать к webhook одновременно
+        self.max_connections = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '40'))
+        self.queue_size = int(os.getenv('WEBHOOK_QUEUE_SIZE', '1000'))
+
+        self._tasks: Set[asyncio.Task] = set()
+        self._runner: Optional[web.AppRunner] = None
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        app.router.add_get('/health', self.health)
+        return app
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if not hmac.compare_digest(request.headers.get(SECRET_HEADER, ''), self.secret):
+            return web.Response(status=401)
+
+        try:
+            update = Update.model_validate(await request.json(), context={'bot': self.bot})
+        except Exception as e:
+            print(f"Некорректный апдейт в webhook: {e}")
+            return web.Response(status=400)
+
+        if len(self._tasks) >= self.queue_size:
+            # Telegram повторит доставку позже — лучше так, чем копить апдейты без предела
+            return web.Response(status=503)
+
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.Response()
+
+    async def health(self, request: web.Request) -> web.Response:
+        return web.json_response({'pending': len(self._tasks), 'limit': self.queue_size})
+
+    async def _process(self, update: Update):
+        try:
+            await self.dp.feed_update(self.bot, update)
+        except Exception as e:
+            print(f"Ошибка обработки апдейта {update.update_id}: {e}")
+
+    async def start(self, set_webhook: bool = True):
+        self._runner = web.AppRunner(self.create_app())
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port, reuse_port=True)
+        await site.start()
+        print(f"Webhook слушает {self.host}:{self.port}{self.path}")
+
+        # Webhook регистрирует только один процесс, остальные просто слушают тот же порт
+        if set_webhook and self.base_url:
+            await self.bot.set_webhook(
+                f"{self.base_url}{self.path}",
+                secret_token=self.secret,
+                allowed_updates=self.dp.resolve_used_update_types(),
+                max_connections=self.max_connections,
+            )
+
+    async def serve(self, set_webhook: bool = True):
+        """Запускает сервер и работает до отмены"""
+        await self.start(set_webhook)
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await self.stop()
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+        # Дорабатываем уже принятые апдейты
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)